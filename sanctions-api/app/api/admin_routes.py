@@ -10,6 +10,8 @@ import logging
 from app.models.database import get_db
 from app.models.entities import Client, ApiUsage, Entity, UpdateLog
 from app.schemas.entities import ClientInfo
+from app.core.client_cache import invalidate_client, reconcile_monthly_usage
+from app.core.usage_counter import usage_counter
 from pydantic import BaseModel
 
 # Configurar logging
@@ -278,8 +280,8 @@ async def get_api_usage_overview(
         month_start = today.replace(day=1)
         
         # Estadísticas generales
-        total_clients = db.query(Client).count()
-        active_clients = db.query(Client).filter(Client.is_active == True).count()
+        total_clients = db.query(func.count(Client.id)).scalar()
+        active_clients = db.query(func.count(Client.id)).filter(Client.is_active == True).scalar()
         
         # Estadísticas generales (manejar casos sin registros)
         total_queries_today_result = db.query(func.sum(ApiUsage.queries_count)).filter(
@@ -400,6 +402,7 @@ async def toggle_client_status(
         
         client.is_active = not client.is_active
         db.commit()
+        invalidate_client(client.api_key)
         
         return {
             "client_id": client_id,
@@ -433,6 +436,7 @@ async def regenerate_api_key(
         client.api_key = str(uuid.uuid4())
         
         db.commit()
+        invalidate_client(old_key)
         
         return {
             "client_id": client_id,
@@ -446,4 +450,51 @@ async def regenerate_api_key(
     except Exception as e:
         logger.error(f"Error regenerando API key: {e}")
         db.rollback()
-        raise HTTPException(status_code=500, detail="Error regenerando API key")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Error regenerando API key")
+
+@admin_router.post("/clients/{client_id}/invalidate-cache")
+async def invalidate_client_cache(
+    client_id: str,
+    _: bool = Depends(get_admin_access),
+    db: Session = Depends(get_db)
+):
+    """Eliminar de la caché de autenticación los datos de un cliente"""
+    
+    client = db.query(Client).filter(Client.client_id == client_id).first()
+    
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    
+    invalidate_client(client.api_key)
+    await usage_counter.reset(client.client_id, date.today().strftime('%Y-%m'))
+    
+    return {
+        "client_id": client_id,
+        "message": "Caché del cliente invalidada"
+    }
+
+
+@admin_router.post("/usage/reconcile")
+async def reconcile_usage(
+    _: bool = Depends(get_admin_access),
+    db: Session = Depends(get_db)
+):
+    """Recalcular los totales mensuales de uso desde los registros diarios"""
+    
+    try:
+        client_ids = reconcile_monthly_usage(db)
+        
+        # Los contadores de cuota se vuelven a inicializar desde los totales corregidos
+        year_month = date.today().strftime('%Y-%m')
+        for client_id in client_ids:
+            await usage_counter.reset(client_id, year_month)
+        
+        return {
+            "clients_updated": len(client_ids),
+            "message": "Totales mensuales recalculados"
+        }
+        
+    except Exception as e:
+        logger.error(f"Error recalculando uso mensual: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Error recalculando uso mensual")
@@ -1,7 +1,7 @@
 # app/api/routes.py
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, Header
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func, desc
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Header, Response
+from sqlalchemy.orm import Session, selectinload, raiseload
+from sqlalchemy import or_, and_, func
 from typing import Optional, List
 import time
 import logging
@@ -9,7 +9,7 @@ from datetime import date, datetime
 from sqlalchemy import func
 
 from app.models.database import get_db
-from app.models.entities import Entity, Alias, Address, Document, Client, ApiUsage, UpdateLog
+from app.models.entities import Entity, Alias, Address, Document, Client, ApiUsage, DbStats
 from app.schemas.entities import (
     Entity as EntitySchema,
     SearchResponse, 
@@ -20,6 +20,7 @@ from app.schemas.entities import (
     SearchFilters
 )
 from app.core.config import settings
+from app.core.db_stats import refresh_db_stats
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -27,6 +28,20 @@ logger = logging.getLogger(__name__)
 # Crear router
 router = APIRouter()
 
+# Carga de relaciones del schema Entity con un SELECT ... IN por relación (evita N+1)
+ENTITY_LOAD_OPTIONS = [
+    selectinload(Entity.aliases),
+    selectinload(Entity.documents),
+    selectinload(Entity.addresses),
+    selectinload(Entity.births),
+    selectinload(Entity.nationalities),
+    selectinload(Entity.sanctions),
+]
+
+# En desarrollo, fallar ante cualquier otra carga lazy en lugar de ocultarla
+if settings.debug:
+    ENTITY_LOAD_OPTIONS.append(raiseload('*'))
+
 # Importar dependencia de autenticación
 async def get_authenticated_client(
     x_api_key: str = Header(..., description="API Key para autenticación"),
@@ -81,7 +96,7 @@ def build_search_query(db: Session, query: str, filters: Optional[SearchFilters]
     """Construir consulta de búsqueda con filtros"""
     
     # Consulta base
-    base_query = db.query(Entity)
+    base_query = db.query(Entity).options(*ENTITY_LOAD_OPTIONS)
     
     # Aplicar filtros
     if filters:
@@ -159,7 +174,6 @@ async def search_entities(
         
         # Ejecutar consulta con paginación
         entities = query_obj.offset(offset).limit(limit).all()
-        total_count = query_obj.count()
         
         # Calcular puntuaciones y crear resultados
         results = []
@@ -207,14 +221,17 @@ async def search_entities(
         
         search_time = (time.time() - start_time) * 1000  # en milisegundos
         
-        return SearchResponse(
+        search_response = SearchResponse(
             query=q,
             total_results=len(results),
             results=results,
             search_time_ms=round(search_time, 2),
-            filters_applied=filters.dict() if filters else None
+            filters_applied=filters.model_dump() if filters else None
         )
         
+        # Serializar directamente en pydantic-core (sin revalidar ni pasar por jsonable_encoder)
+        return Response(content=search_response.model_dump_json(), media_type="application/json")
+        
     except Exception as e:
         logger.error(f"Error en búsqueda: {e}")
         raise HTTPException(status_code=500, detail="Error interno en la búsqueda")
@@ -226,7 +243,7 @@ async def get_entity(
 ):
     """Obtener detalles completos de una entidad"""
     
-    entity = db.query(Entity).filter(Entity.id == entity_id).first()
+    entity = db.query(Entity).options(*ENTITY_LOAD_OPTIONS).filter(Entity.id == entity_id).first()
     
     if not entity:
         raise HTTPException(status_code=404, detail="Entidad no encontrada")
@@ -238,36 +255,21 @@ async def get_database_stats(db: Session = Depends(get_db)):
     """Obtener estadísticas de la base de datos"""
     
     try:
-        # Estadísticas generales
-        total_entities = db.query(Entity).count()
-        total_aliases = db.query(Alias).count()
-        total_addresses = db.query(Address).count()
-        total_documents = db.query(Document).count()
-        
-        # Estadísticas por fuente
-        entities_by_source = {}
-        for source in ["OFAC", "UN"]:
-            count = db.query(Entity).filter(Entity.source == source).count()
-            entities_by_source[source] = count
-        
-        # Estadísticas por tipo
-        entities_by_type = {}
-        for entity_type in ["INDIVIDUAL", "ENTITY", "VESSEL", "AIRCRAFT"]:
-            count = db.query(Entity).filter(Entity.type == entity_type).count()
-            entities_by_type[entity_type] = count
+        # Fila precalculada por el ETL y el refresco periódico (lectura O(1))
+        stats = db.get(DbStats, 1)
         
-        # Última actualización
-        last_update = db.query(UpdateLog).order_by(desc(UpdateLog.update_date)).first()
-        last_update_date = last_update.update_date if last_update else None
+        if stats is None:
+            refresh_db_stats(db, exact=True)
+            stats = db.get(DbStats, 1)
         
         return DatabaseStats(
-            total_entities=total_entities,
-            entities_by_source=entities_by_source,
-            entities_by_type=entities_by_type,
-            last_update=last_update_date,
-            total_aliases=total_aliases,
-            total_addresses=total_addresses,
-            total_documents=total_documents
+            total_entities=stats.total_entities,
+            entities_by_source=stats.entities_by_source,
+            entities_by_type=stats.entities_by_type,
+            last_update=stats.last_update,
+            total_aliases=stats.total_aliases,
+            total_addresses=stats.total_addresses,
+            total_documents=stats.total_documents
         )
         
     except Exception as e:
@@ -0,0 +1,118 @@
+# app/core/client_cache.py
+from typing import List, NamedTuple, Optional
+from datetime import date
+from cachetools import TTLCache
+from sqlalchemy import select, func, bindparam, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.database import dialect_insert
+from app.models.entities import Client, ApiUsage, ClientMonthlyUsage
+from app.models.partitions import month_start
+
+class CachedClient(NamedTuple):
+    """Datos del cliente necesarios para autenticar y controlar cuotas"""
+    client_id: str
+    plan_type: str
+    monthly_quota: int
+    is_active: bool
+
+# Caché en proceso de clientes activos por API Key (la tabla cambia muy poco)
+client_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+# Sentencias precompiladas (estilo 2.0 con bind parameters, reutilizan la caché de SQL compilado)
+CLIENT_BY_API_KEY = select(Client).where(
+    Client.api_key == bindparam('api_key'),
+    Client.is_active == True
+)
+
+MONTHLY_USAGE_BY_CLIENT = select(
+    ApiUsage.client_id,
+    func.sum(ApiUsage.queries_count)
+).where(
+    ApiUsage.query_date >= bindparam('month_start')
+).group_by(ApiUsage.client_id)
+
+# Total de un cliente en un mes, con la clave del rollup (para inicializarlo si falta)
+MONTHLY_USAGE_ROLLUP_ROW = select(
+    ApiUsage.client_id,
+    bindparam('year_month', type_=String),
+    func.sum(ApiUsage.queries_count)
+).where(
+    ApiUsage.client_id == bindparam('client_id'),
+    ApiUsage.query_date >= bindparam('month_start'),
+    ApiUsage.query_date < bindparam('month_end')
+).group_by(ApiUsage.client_id)
+
+async def get_client_by_api_key(db: AsyncSession, api_key: str) -> Optional[CachedClient]:
+    """Obtener cliente activo por API Key, consultando la BD solo si no está en caché"""
+    cached = client_cache.get(api_key)
+    if cached is not None:
+        return cached
+    
+    result = await db.execute(CLIENT_BY_API_KEY, {'api_key': api_key})
+    client = result.scalar_one_or_none()
+    
+    if not client:
+        return None
+    
+    cached = CachedClient(
+        client_id=client.client_id,
+        plan_type=client.plan_type,
+        monthly_quota=client.monthly_quota,
+        is_active=client.is_active
+    )
+    client_cache[api_key] = cached
+    return cached
+
+def invalidate_client(api_key: str) -> None:
+    """Eliminar un cliente de la caché (al desactivarlo o rotar su API Key)"""
+    client_cache.pop(api_key, None)
+
+
+async def get_monthly_usage(db: AsyncSession, client_id: str, year_month: str) -> int:
+    """Obtener el uso de un mes desde el rollup persistido (inicializa el contador de cuota)"""
+    # Lectura O(1) del rollup mensual que mantiene el flusher de uso
+    row = await db.get(ClientMonthlyUsage, (client_id, year_month))
+    if row is not None:
+        return row.total
+    
+    # Sin fila (p. ej. uso anterior al rollup): sumar api_usage del mes y guardarlo
+    start = date(int(year_month[:4]), int(year_month[5:7]), 1)
+    # Sobre la Table: con el modelo ORM, el dict de parámetros se tomaría como filas a insertar
+    stmt = dialect_insert(db)(ClientMonthlyUsage.__table__).from_select(
+        ['client_id', 'year_month', 'total'], MONTHLY_USAGE_ROLLUP_ROW
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['client_id', 'year_month'],
+        set_={'total': stmt.excluded.total}
+    )
+    await db.execute(stmt, {
+        'client_id': client_id,
+        'year_month': year_month,
+        'month_start': start,
+        'month_end': month_start(start, 1)
+    })
+    await db.commit()
+    
+    row = await db.get(ClientMonthlyUsage, (client_id, year_month), populate_existing=True)
+    return row.total if row else 0
+
+def reconcile_monthly_usage(db: Session) -> List[str]:
+    """Recalcular el rollup del mes actual desde api_usage (corrige desviaciones)"""
+    today = date.today()
+    rows = db.execute(MONTHLY_USAGE_BY_CLIENT, {'month_start': today.replace(day=1)}).all()
+    
+    if rows:
+        stmt = dialect_insert(db)(ClientMonthlyUsage).values([
+            {'client_id': client_id, 'year_month': today.strftime('%Y-%m'), 'total': int(total)}
+            for client_id, total in rows
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['client_id', 'year_month'],
+            set_={'total': stmt.excluded.total}
+        )
+        db.execute(stmt)
+        db.commit()
+    
+    return [client_id for client_id, _ in rows]
@@ -1,6 +1,6 @@
 # app/core/config.py
 from pydantic_settings import BaseSettings
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import os
 
 class Settings(BaseSettings):
@@ -52,6 +52,15 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     log_file: str = "logs/sanctions_api.log"
     
+    # Configuración de CORS (orígenes separados por comas)
+    cors_origins: str = "http://localhost:5173,http://127.0.0.1:5173"
+    
+    # Redis para contadores de cuota compartidos (opcional; sin él se usa memoria)
+    redis_url: Optional[str] = None
+    
+    # Meses de uso de la API que se conservan adjuntos a api_usage
+    usage_retention_months: int = 13
+    
     # Configuración de rate limiting
     rate_limit_per_minute: int = 60
     
@@ -0,0 +1,82 @@
+# app/core/db_stats.py
+import logging
+from datetime import datetime
+from typing import Dict
+from sqlalchemy import select, func, text
+from sqlalchemy.orm import Session
+
+from app.models.database import dialect_insert
+from app.models.entities import Entity, Alias, Address, Document, UpdateLog, DbStats
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de refresco de la fila de estadísticas desde la API
+DB_STATS_REFRESH_INTERVAL = 300  # segundos
+
+COUNTED_TABLES = {
+    'total_entities': Entity,
+    'total_aliases': Alias,
+    'total_addresses': Address,
+    'total_documents': Document,
+}
+
+# Estimación del planificador: no recorre la tabla (-1 si nunca se analizó)
+RELTUPLES = text(
+    "SELECT relname, reltuples::bigint FROM pg_class "
+    "WHERE relkind IN ('r', 'p') AND relname IN ('entities', 'aliases', 'addresses', 'documents')"
+)
+
+def _table_totals(db: Session, exact: bool) -> Dict[str, int]:
+    """Totales por tabla: estimados en PostgreSQL, COUNT(*) si se piden exactos o no hay estimación"""
+    estimates = {}
+    if not exact and db.get_bind().dialect.name == "postgresql":
+        estimates = dict(db.execute(RELTUPLES).all())
+    
+    totals = {}
+    for field, model in COUNTED_TABLES.items():
+        estimate = estimates.get(model.__tablename__, -1)
+        if estimate >= 0:
+            totals[field] = int(estimate)
+        else:
+            totals[field] = db.execute(select(func.count()).select_from(model)).scalar()
+    
+    return totals
+
+def refresh_db_stats(db: Session, exact: bool = False) -> bool:
+    """Recalcular la fila única de db_stats (la llaman el ETL y el refresco periódico de la API)"""
+    try:
+        values = _table_totals(db, exact)
+        
+        # Un único recorrido agrupado (index-only scan sobre idx_entities_src_status)
+        entities_by_source = {"OFAC": 0, "UN": 0}
+        entities_by_type = {"INDIVIDUAL": 0, "ENTITY": 0, "VESSEL": 0, "AIRCRAFT": 0}
+        rows = db.execute(
+            select(Entity.source, Entity.type, func.count()).group_by(Entity.source, Entity.type)
+        ).all()
+        for source, entity_type, count in rows:
+            if source in entities_by_source:
+                entities_by_source[source] += count
+            if entity_type in entities_by_type:
+                entities_by_type[entity_type] += count
+        
+        values.update(
+            id=1,
+            entities_by_source=entities_by_source,
+            entities_by_type=entities_by_type,
+            last_update=db.execute(select(func.max(UpdateLog.update_date))).scalar(),
+            updated_at=datetime.utcnow()
+        )
+        
+        stmt = dialect_insert(db)(DbStats).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={key: stmt.excluded[key] for key in values if key != 'id'}
+        )
+        db.execute(stmt)
+        db.commit()
+        return True
+    
+    except Exception as e:
+        logger.warning(f"No se pudieron refrescar las estadísticas de la BD: {e}")
+        db.rollback()
+        return False
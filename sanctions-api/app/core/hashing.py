@@ -0,0 +1,12 @@
+# app/core/hashing.py
+import hashlib
+from typing import Union
+
+# 16 bytes = 32 caracteres hex, la misma longitud que el MD5 que sustituye
+CONTENT_HASH_SIZE = 16
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """Huella para detectar cambios (archivos y entidades); no es una firma criptográfica"""
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.blake2b(data, digest_size=CONTENT_HASH_SIZE).hexdigest()
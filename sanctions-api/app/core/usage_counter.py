@@ -0,0 +1,89 @@
+# app/core/usage_counter.py
+import logging
+from typing import Optional
+from cachetools import TTLCache
+
+from app.core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Los contadores mensuales viven algo más de un mes en Redis
+MONTH_KEY_TTL = 35 * 86400
+
+# INCR solo si la clave ya fue inicializada desde la BD (evita empezar en 1 tras una expulsión)
+INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return nil
+"""
+
+class MemoryUsageCounter:
+    """Contador de uso mensual en proceso (respaldo sin Redis)"""
+    
+    def __init__(self):
+        # Se vuelve a leer de la BD cada 30 s para sumar lo registrado por otros workers
+        self.counts: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+    
+    async def get(self, client_id: str, year_month: str) -> Optional[int]:
+        count = self.counts.get((client_id, year_month))
+        return count[0] if count is not None else None
+    
+    async def backfill(self, client_id: str, year_month: str, total: int) -> None:
+        self.counts.setdefault((client_id, year_month), [total])
+    
+    async def incr(self, client_id: str, year_month: str) -> None:
+        # Se modifica en sitio para no renovar el TTL de la entrada
+        count = self.counts.get((client_id, year_month))
+        if count is not None:
+            count[0] += 1
+    
+    async def reset(self, client_id: str, year_month: str) -> None:
+        self.counts.pop((client_id, year_month), None)
+    
+    async def close(self) -> None:
+        self.counts.clear()
+
+class RedisUsageCounter:
+    """Contador de uso mensual compartido entre workers en Redis"""
+    
+    def __init__(self, url: str):
+        self.redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self.incr_if_exists = self.redis.register_script(INCR_IF_EXISTS)
+    
+    @staticmethod
+    def _key(client_id: str, year_month: str) -> str:
+        return f"m:{client_id}:{year_month}"
+    
+    async def get(self, client_id: str, year_month: str) -> Optional[int]:
+        value = await self.redis.get(self._key(client_id, year_month))
+        return int(value) if value is not None else None
+    
+    async def backfill(self, client_id: str, year_month: str, total: int) -> None:
+        await self.redis.set(self._key(client_id, year_month), total, ex=MONTH_KEY_TTL, nx=True)
+    
+    async def incr(self, client_id: str, year_month: str) -> None:
+        await self.incr_if_exists(keys=[self._key(client_id, year_month)])
+    
+    async def reset(self, client_id: str, year_month: str) -> None:
+        await self.redis.delete(self._key(client_id, year_month))
+    
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+def create_usage_counter():
+    """Usar Redis si está configurado y disponible; si no, el contador en memoria"""
+    if settings.redis_url:
+        if aioredis is not None:
+            return RedisUsageCounter(settings.redis_url)
+        logger.warning("REDIS_URL configurada pero el paquete redis no está instalado; usando contador en memoria")
+    
+    return MemoryUsageCounter()
+
+# Instancia global (la conexión a Redis se abre de forma perezosa)
+usage_counter = create_usage_counter()
@@ -2,10 +2,10 @@
 import requests
 import xml.etree.ElementTree as ET
 from typing import Dict, List, Optional
-import hashlib
 import logging
 from datetime import datetime, date
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
 
 from app.models.database import SessionLocal
 from app.models.entities import (
@@ -13,11 +13,16 @@ from app.models.entities import (
     Nationality, Sanction, UpdateLog
 )
 from app.core.config import settings
+from app.core.db_stats import refresh_db_stats
+from app.core.hashing import content_hash
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Entidades por lote: una consulta de existencia (IN) y un commit por lote
+ENTITY_BATCH_SIZE = 100
+
 class OFACParserFinal:
     """Parser final para OFAC usando la estructura real confirmada"""
     
@@ -56,7 +61,7 @@ class OFACParserFinal:
     
     def calculate_hash(self, xml_content: str) -> str:
         """Calcular hash del contenido XML"""
-        return hashlib.md5(xml_content.encode()).hexdigest()
+        return content_hash(xml_content)
     
     def parse_date(self, date_string: str) -> Optional[date]:
         """Parsear fecha desde string"""
@@ -252,22 +257,32 @@ class OFACParserFinal:
             
             processed_count = 0
             
-            for sdn_entry in sdn_entries:
-                try:
-                    entity_data = self.extract_entity_data(sdn_entry)
+            for start in range(0, len(sdn_entries), ENTITY_BATCH_SIZE):
+                batch = []
+                for sdn_entry in sdn_entries[start:start + ENTITY_BATCH_SIZE]:
+                    try:
+                        entity_data = self.extract_entity_data(sdn_entry)
+                        
+                        if entity_data['name']:  # Solo procesar si tiene nombre
+                            batch.append(entity_data)
                     
-                    if entity_data['name']:  # Solo procesar si tiene nombre
-                        self.process_entity(entity_data)
+                    except Exception as e:
+                        logger.error(f"Error procesando entidad: {e}")
+                        self.stats['errors'].append(str(e))
+                
+                # Una sola consulta para saber qué entidades del lote ya existen
+                existing = self.load_existing_entities([data['source_id'] for data in batch])
+                for entity_data in batch:
+                    try:
+                        self.process_entity(entity_data, existing)
                         processed_count += 1
-                        
-                        if processed_count % 100 == 0:
-                            logger.info(f"Procesadas {processed_count} entidades...")
-                            self.db.commit()
+                    
+                    except Exception as e:
+                        logger.error(f"Error procesando entidad: {e}")
+                        self.stats['errors'].append(str(e))
                 
-                except Exception as e:
-                    logger.error(f"Error procesando entidad: {e}")
-                    self.stats['errors'].append(str(e))
-                    continue
+                logger.info(f"Procesadas {processed_count} entidades...")
+                self.db.commit()
             
             # Commit final
             self.db.commit()
@@ -279,14 +294,33 @@ class OFACParserFinal:
             self.db.rollback()
             return False
     
-    def process_entity(self, entity_data: Dict) -> Entity:
+    def load_existing_entities(self, source_ids: List[str]) -> Dict[str, Entity]:
+        """Entidades OFAC ya guardadas del lote (con sus relaciones), por source_id"""
+        if not source_ids:
+            return {}
+        
+        entities = self.db.scalars(
+            select(Entity)
+            .where(Entity.source == 'OFAC', Entity.source_id.in_(source_ids))
+            .options(
+                selectinload(Entity.aliases), selectinload(Entity.addresses),
+                selectinload(Entity.documents), selectinload(Entity.nationalities),
+                selectinload(Entity.sanctions)
+            )
+        ).all()
+        return {entity.source_id: entity for entity in entities}
+    
+    def process_entity(self, entity_data: Dict, existing: Optional[Dict[str, Entity]] = None) -> Entity:
         """Procesar y guardar una entidad en la base de datos"""
         try:
-            # Verificar si la entidad ya existe
-            existing_entity = self.db.query(Entity).filter(
-                Entity.source == 'OFAC',
-                Entity.source_id == entity_data['source_id']
-            ).first()
+            # Verificar si la entidad ya existe (en el lote precargado o con una consulta)
+            if existing is not None:
+                existing_entity = existing.get(entity_data['source_id'])
+            else:
+                existing_entity = self.db.query(Entity).filter(
+                    Entity.source == 'OFAC',
+                    Entity.source_id == entity_data['source_id']
+                ).first()
             
             if existing_entity:
                 # Actualizar entidad existente
@@ -317,10 +351,14 @@ class OFACParserFinal:
                     name=entity_data['name'],
                     type=entity_data['type'],
                     status='ACTIVE',
-                    hash_signature=hashlib.md5(str(entity_data).encode()).hexdigest()
+                    hash_signature=content_hash(str(entity_data))
                 )
                 self.db.add(entity)
                 self.stats['entities_added'] += 1
+                
+                # Un source_id repetido en el XML actualiza la entidad recién creada
+                if existing is not None:
+                    existing[entity_data['source_id']] = entity
             
             # Flush para obtener el ID
             self.db.flush()
@@ -428,6 +466,10 @@ class OFACParserFinal:
             self.db.add(update_log)
             self.db.commit()
             
+            # Recalcular las estadísticas precalculadas con los nuevos datos
+            if success:
+                refresh_db_stats(self.db, exact=True)
+            
             return {
                 'status': 'success' if success else 'failed',
                 'stats': self.stats,
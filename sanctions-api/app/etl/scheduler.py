@@ -1,6 +1,8 @@
 # app/etl/scheduler.py
 import asyncio
 import logging
+import signal
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Dict, List
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -15,13 +17,17 @@ from email.mime.multipart import MIMEMultipart
 from app.etl.ofac_parser import OFACParser, run_ofac_update
 from app.etl.un_parser import UNParser, run_un_update
 from app.core.config import settings
-from app.models.database import SessionLocal
+from app.models.database import AsyncSessionLocal, async_engine
 from app.models.entities import UpdateLog
+from sqlalchemy import select, func
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Ejecuciones recientes que se conservan en memoria
+UPDATE_HISTORY_SIZE = 100
+
 class ETLScheduler:
     """Scheduler para ejecutar actualizaciones automáticas de datos"""
     
@@ -47,7 +53,9 @@ class ETLScheduler:
         )
         
         self.is_running = False
-        self.update_history = []
+        self._stop_event = None
+        # Solo las últimas ejecuciones (el histórico completo está en update_logs)
+        self.update_history = deque(maxlen=UPDATE_HISTORY_SIZE)
     
     def send_notification(self, subject: str, body: str, is_error: bool = False):
         """Enviar notificación por email (opcional)"""
@@ -100,7 +108,7 @@ class ETLScheduler:
             self.update_history.append({
                 'source': 'OFAC',
                 'timestamp': datetime.utcnow(),
-                'result': result,
+                'status': result.get('status'),
                 'success': result.get('status') == 'success'
             })
             
@@ -162,7 +170,7 @@ Revisar logs para más detalles.
             self.update_history.append({
                 'source': 'UN',
                 'timestamp': datetime.utcnow(),
-                'result': result,
+                'status': result.get('status'),
                 'success': result.get('status') == 'success'
             })
             
@@ -213,15 +221,14 @@ Revisar logs para más detalles.
     async def health_check_job(self):
         """Job para verificar salud del sistema"""
         try:
-            db = SessionLocal()
-            
-            # Verificar conexión a BD
-            db.execute("SELECT 1")
-            
-            # Verificar actualizaciones recientes
-            recent_updates = db.query(UpdateLog).filter(
-                UpdateLog.update_date >= datetime.utcnow() - timedelta(days=7)
-            ).count()
+            # AsyncSession: el job corre en el event loop del scheduler
+            async with AsyncSessionLocal() as db:
+                # Una sola ida y vuelta: si el COUNT responde, la conexión funciona
+                recent_updates = await db.scalar(
+                    select(func.count()).select_from(UpdateLog).where(
+                        UpdateLog.update_date >= datetime.utcnow() - timedelta(days=7)
+                    )
+                )
             
             if recent_updates == 0:
                 logger.warning("No hay actualizaciones en los últimos 7 días")
@@ -232,7 +239,6 @@ Revisar logs para más detalles.
                     is_error=True
                 )
             
-            db.close()
             logger.info("Health check completado")
             
         except Exception as e:
@@ -304,6 +310,30 @@ Revisar logs para más detalles.
             logger.error(f"Error iniciando scheduler: {e}")
             raise
     
+    async def run_until_stopped(self):
+        """Iniciar el scheduler en el loop actual y esperar a SIGINT/SIGTERM o request_stop()"""
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except NotImplementedError:
+                # Windows: el manejador corre fuera del loop
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(self.request_stop))
+        
+        self.start()
+        try:
+            await self._stop_event.wait()
+        finally:
+            self.stop()
+            await async_engine.dispose()
+    
+    def request_stop(self):
+        """Pedir la parada de run_until_stopped()"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+    
     def stop(self):
         """Detener scheduler"""
         try:
@@ -338,7 +368,7 @@ Revisar logs para más detalles.
         return {
             'scheduler_running': self.is_running,
             'jobs': jobs,
-            'recent_updates': self.update_history[-10:] if self.update_history else []
+            'recent_updates': list(self.update_history)[-10:]
         }
     
     async def run_manual_update(self, source: str) -> Dict:
@@ -361,7 +391,7 @@ Revisar logs para más detalles.
             self.update_history.append({
                 'source': source.upper(),
                 'timestamp': datetime.utcnow(),
-                'result': result,
+                'status': result.get('status'),
                 'success': result.get('status') == 'success',
                 'manual': True
             })
@@ -397,24 +427,6 @@ async def run_manual_update(source: str):
     return await etl_scheduler.run_manual_update(source)
 
 if __name__ == "__main__":
-    # Ejecutar scheduler en modo standalone
-    import signal
-    import sys
-    
-    def signal_handler(sig, frame):
-        logger.info("Recibida señal de terminación")
-        etl_scheduler.stop()
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    # Iniciar scheduler
-    etl_scheduler.start()
-    
-    # Mantener el programa corriendo
-    try:
-        asyncio.get_event_loop().run_forever()
-    except KeyboardInterrupt:
-        logger.info("Terminando scheduler...")
-        etl_scheduler.stop()
\ No newline at end of file
+    # Ejecutar scheduler en modo standalone (hasta SIGINT/SIGTERM)
+    asyncio.run(etl_scheduler.run_until_stopped())
+    logger.info("Terminando scheduler...")
\ No newline at end of file
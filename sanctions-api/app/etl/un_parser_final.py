@@ -1,11 +1,11 @@
 # app/etl/un_parser_final.py
+import logging
 import requests
 import xml.etree.ElementTree as ET
 from typing import Dict, List, Optional
-import hashlib
-import logging
 from datetime import datetime, date
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session, selectinload
 
 from app.models.database import SessionLocal
 from app.models.entities import (
@@ -13,11 +13,26 @@ from app.models.entities import (
     Nationality, Sanction, UpdateLog
 )
 from app.core.config import settings
+from app.core.db_stats import refresh_db_stats
+from app.core.hashing import content_hash
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Entidades por lote: una consulta de existencia (IN) y un commit por lote
+ENTITY_BATCH_SIZE = 100
+
+# Normalización de calidad de alias
+QUALITY_MAPPING = {
+    'strong': 'STRONG',
+    'weak': 'WEAK',
+    'good': 'GOOD',
+    'low': 'LOW',
+    'high': 'HIGH',
+    'medium': 'MEDIUM'
+}
+
 class UNParserFinal:
     """Parser final para ONU usando la estructura real confirmada"""
     
@@ -33,19 +48,42 @@ class UNParserFinal:
             'sanctions_added': 0,
             'errors': []
         }
+        # Nacimientos pendientes de insertar en bloque (listas paralelas)
+        self.birth_entity_ids = []
+        self.birth_dobs = []
+        self.birth_pobs = []
+        # Metadatos HTTP de la última descarga (GET condicional)
+        self.not_modified = False
+        self.etag = None
+        self.last_modified = None
     
-    def download_un_data(self, url: str) -> Optional[str]:
-        """Descargar archivo XML de ONU"""
+    def download_un_data(self, url: str, etag: Optional[str] = None,
+                         last_modified: Optional[str] = None) -> Optional[str]:
+        """Descargar archivo XML de ONU (condicional si se conoce ETag/Last-Modified)"""
         try:
             logger.info(f"Descargando datos de ONU: {url}")
             
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
             
             response = requests.get(url, headers=headers, timeout=120)
+            
+            # 304: el servidor confirma que no hay cambios y no envía el cuerpo
+            if response.status_code == 304:
+                logger.info("El servidor de ONU respondió 304 Not Modified")
+                self.not_modified = True
+                return None
+            
             response.raise_for_status()
             
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+            
             logger.info(f"Descarga exitosa. Tamaño: {len(response.text)} caracteres")
             return response.text
             
@@ -55,7 +93,7 @@ class UNParserFinal:
     
     def calculate_hash(self, xml_content: str) -> str:
         """Calcular hash del contenido XML"""
-        return hashlib.md5(xml_content.encode()).hexdigest()
+        return content_hash(xml_content)
     
     def parse_date(self, date_string: str) -> Optional[date]:
         """Parsear fecha desde string"""
@@ -74,6 +112,60 @@ class UNParserFinal:
         
         return None
     
+    def extract_aliases(self, element, tag: str) -> List[Dict]:
+        """Extraer aliases (INDIVIDUAL_ALIAS / ENTITY_ALIAS) de un elemento"""
+        aliases = []
+        
+        for alias in element.findall(tag):
+            alias_name = alias.findtext('ALIAS_NAME', '').strip()
+            if not alias_name:
+                continue
+            
+            # Normalizar calidad de alias - mantener valor original si no está mapeado
+            quality = alias.findtext('QUALITY', '').strip()
+            if quality:
+                normalized_quality = QUALITY_MAPPING.get(quality.lower(), quality.upper())
+            else:
+                normalized_quality = 'UNKNOWN'
+            
+            aliases.append({
+                'name': alias_name,
+                'quality': normalized_quality
+            })
+        
+        return aliases
+    
+    def extract_addresses(self, element, tag: str, include_note: bool = False) -> List[Dict]:
+        """Extraer direcciones (INDIVIDUAL_ADDRESS / ENTITY_ADDRESS) de un elemento"""
+        addresses = []
+        
+        for address in element.findall(tag):
+            # Extraer partes de la dirección
+            address_parts = []
+            for field in ['STREET', 'CITY', 'STATE_PROVINCE']:
+                part = address.findtext(field, '').strip()
+                if part:
+                    address_parts.append(part)
+            
+            # Extraer país
+            country = address.findtext('COUNTRY', '').strip()
+            if country:
+                address_parts.append(country)
+            
+            # Extraer nota adicional
+            if include_note:
+                note = address.findtext('NOTE', '').strip()
+                if note:
+                    address_parts.append(f"Nota: {note}")
+            
+            if address_parts:
+                addresses.append({
+                    'full_address': ', '.join(address_parts),
+                    'country': country
+                })
+        
+        return addresses
+    
     def extract_individual_data(self, individual) -> Dict:
         """Extraer datos de un individuo del XML de ONU"""
         entity_data = {
@@ -85,7 +177,8 @@ class UNParserFinal:
             'addresses': [],
             'documents': [],
             'nationalities': [],
-            'birth_info': {},
+            'birth_dob': '',
+            'birth_pob': '',
             'sanctions': [],
             'committee': '',
             'resolution': '',
@@ -95,126 +188,52 @@ class UNParserFinal:
         
         try:
             # Extraer ID
-            dataid = individual.find('DATAID')
-            if dataid is not None and dataid.text:
-                entity_data['source_id'] = dataid.text.strip()
+            entity_data['source_id'] = individual.findtext('DATAID', '').strip()
             
             # Extraer nombres
             name_parts = []
             for name_field in ['FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'FOURTH_NAME']:
-                name_elem = individual.find(name_field)
-                if name_elem is not None and name_elem.text:
-                    name_parts.append(name_elem.text.strip())
+                name_part = individual.findtext(name_field, '').strip()
+                if name_part:
+                    name_parts.append(name_part)
             
             if name_parts:
                 entity_data['name'] = ' '.join(name_parts)
             
-            # Extraer comentarios/remarks
-            comments = individual.find('COMMENTS1')
-            if comments is not None and comments.text:
-                entity_data['remarks'] = comments.text.strip()
+            # Extraer comentarios, tipo de lista UN y número de referencia
+            entity_data['remarks'] = individual.findtext('COMMENTS1', '').strip()
+            entity_data['committee'] = individual.findtext('UN_LIST_TYPE', '').strip()
+            entity_data['resolution'] = individual.findtext('REFERENCE_NUMBER', '').strip()
             
             # Extraer fecha de listado
-            listed_on = individual.find('LISTED_ON')
-            if listed_on is not None and listed_on.text:
-                entity_data['listed_on'] = self.parse_date(listed_on.text.strip())
-            
-            # Extraer tipo de lista UN
-            un_list_type = individual.find('UN_LIST_TYPE')
-            if un_list_type is not None and un_list_type.text:
-                entity_data['committee'] = un_list_type.text.strip()
-            
-            # Extraer número de referencia
-            reference_number = individual.find('REFERENCE_NUMBER')
-            if reference_number is not None and reference_number.text:
-                entity_data['resolution'] = reference_number.text.strip()
+            entity_data['listed_on'] = self.parse_date(individual.findtext('LISTED_ON', '').strip())
             
             # Extraer nacionalidades
-            nationality_elem = individual.find('NATIONALITY')
-            if nationality_elem is not None:
-                value_elem = nationality_elem.find('VALUE')
-                if value_elem is not None and value_elem.text:
-                    entity_data['nationalities'].append(value_elem.text.strip())
+            nationality = individual.findtext('NATIONALITY/VALUE', '').strip()
+            if nationality:
+                entity_data['nationalities'].append(nationality)
             
             # Extraer fecha de nacimiento
-            dob_elem = individual.find('INDIVIDUAL_DATE_OF_BIRTH')
-            if dob_elem is not None:
-                year_elem = dob_elem.find('YEAR')
-                if year_elem is not None and year_elem.text:
-                    entity_data['birth_info']['dob'] = year_elem.text.strip()
+            entity_data['birth_dob'] = individual.findtext('INDIVIDUAL_DATE_OF_BIRTH/YEAR', '').strip()
             
             # Extraer lugar de nacimiento
-            pob_elem = individual.find('INDIVIDUAL_PLACE_OF_BIRTH')
-            if pob_elem is not None:
-                country_elem = pob_elem.find('COUNTRY')
-                if country_elem is not None and country_elem.text:
-                    entity_data['birth_info']['pob'] = country_elem.text.strip()
+            entity_data['birth_pob'] = individual.findtext('INDIVIDUAL_PLACE_OF_BIRTH/COUNTRY', '').strip()
             
             # Extraer aliases
-            for alias in individual.findall('INDIVIDUAL_ALIAS'):
-                alias_name = alias.find('ALIAS_NAME')
-                quality = alias.find('QUALITY')
-                
-                if alias_name is not None and alias_name.text:
-                    # Normalizar calidad de alias - mantener valor original si no está mapeado
-                    quality_mapping = {
-                        'strong': 'STRONG',
-                        'weak': 'WEAK',
-                        'good': 'GOOD',
-                        'low': 'LOW',
-                        'high': 'HIGH',
-                        'medium': 'MEDIUM'
-                    }
-                    
-                    if quality is not None and quality.text:
-                        normalized_quality = quality_mapping.get(quality.text.strip().lower(), quality.text.strip().upper())
-                    else:
-                        normalized_quality = 'UNKNOWN'
-                    
-                    entity_data['aliases'].append({
-                        'name': alias_name.text.strip(),
-                        'quality': normalized_quality
-                    })
+            entity_data['aliases'] = self.extract_aliases(individual, 'INDIVIDUAL_ALIAS')
             
             # Extraer direcciones
-            for address in individual.findall('INDIVIDUAL_ADDRESS'):
-                address_parts = []
-                country = ''
-                
-                # Extraer partes de la dirección
-                for field in ['STREET', 'CITY', 'STATE_PROVINCE']:
-                    elem = address.find(field)
-                    if elem is not None and elem.text:
-                        address_parts.append(elem.text.strip())
-                
-                # Extraer país
-                country_elem = address.find('COUNTRY')
-                if country_elem is not None and country_elem.text:
-                    country = country_elem.text.strip()
-                    address_parts.append(country)
-                
-                # Extraer nota adicional
-                note_elem = address.find('NOTE')
-                if note_elem is not None and note_elem.text:
-                    address_parts.append(f"Nota: {note_elem.text.strip()}")
-                
-                if address_parts:
-                    entity_data['addresses'].append({
-                        'full_address': ', '.join(address_parts),
-                        'country': country
-                    })
+            entity_data['addresses'] = self.extract_addresses(individual, 'INDIVIDUAL_ADDRESS', include_note=True)
             
             # Extraer documentos
             for document in individual.findall('INDIVIDUAL_DOCUMENT'):
-                doc_type_elem = document.find('TYPE_OF_DOCUMENT')
-                doc_number_elem = document.find('NUMBER')
-                doc_country_elem = document.find('ISSUING_COUNTRY')
+                doc_number = document.findtext('NUMBER', '').strip()
                 
-                if doc_number_elem is not None and doc_number_elem.text:
+                if doc_number:
                     entity_data['documents'].append({
-                        'type': doc_type_elem.text.strip() if doc_type_elem is not None and doc_type_elem.text else 'UNKNOWN',
-                        'number': doc_number_elem.text.strip(),
-                        'issuer': doc_country_elem.text.strip() if doc_country_elem is not None and doc_country_elem.text else ''
+                        'type': document.findtext('TYPE_OF_DOCUMENT', '').strip() or 'UNKNOWN',
+                        'number': doc_number,
+                        'issuer': document.findtext('ISSUING_COUNTRY', '').strip()
                     })
         
         except Exception as e:
@@ -233,7 +252,8 @@ class UNParserFinal:
             'addresses': [],
             'documents': [],
             'nationalities': [],
-            'birth_info': {},
+            'birth_dob': '',
+            'birth_pob': '',
             'sanctions': [],
             'committee': '',
             'resolution': '',
@@ -243,83 +263,24 @@ class UNParserFinal:
         
         try:
             # Extraer ID
-            dataid = entity.find('DATAID')
-            if dataid is not None and dataid.text:
-                entity_data['source_id'] = dataid.text.strip()
+            entity_data['source_id'] = entity.findtext('DATAID', '').strip()
             
             # Extraer nombre (para entidades solo hay FIRST_NAME)
-            first_name = entity.find('FIRST_NAME')
-            if first_name is not None and first_name.text:
-                entity_data['name'] = first_name.text.strip()
+            entity_data['name'] = entity.findtext('FIRST_NAME', '').strip()
             
-            # Extraer comentarios/remarks
-            comments = entity.find('COMMENTS1')
-            if comments is not None and comments.text:
-                entity_data['remarks'] = comments.text.strip()
+            # Extraer comentarios, tipo de lista UN y número de referencia
+            entity_data['remarks'] = entity.findtext('COMMENTS1', '').strip()
+            entity_data['committee'] = entity.findtext('UN_LIST_TYPE', '').strip()
+            entity_data['resolution'] = entity.findtext('REFERENCE_NUMBER', '').strip()
             
             # Extraer fecha de listado
-            listed_on = entity.find('LISTED_ON')
-            if listed_on is not None and listed_on.text:
-                entity_data['listed_on'] = self.parse_date(listed_on.text.strip())
-            
-            # Extraer tipo de lista UN
-            un_list_type = entity.find('UN_LIST_TYPE')
-            if un_list_type is not None and un_list_type.text:
-                entity_data['committee'] = un_list_type.text.strip()
-            
-            # Extraer número de referencia
-            reference_number = entity.find('REFERENCE_NUMBER')
-            if reference_number is not None and reference_number.text:
-                entity_data['resolution'] = reference_number.text.strip()
+            entity_data['listed_on'] = self.parse_date(entity.findtext('LISTED_ON', '').strip())
             
             # Extraer aliases
-            for alias in entity.findall('ENTITY_ALIAS'):
-                alias_name = alias.find('ALIAS_NAME')
-                quality = alias.find('QUALITY')
-                
-                if alias_name is not None and alias_name.text:
-                    # Normalizar calidad de alias - mantener valor original si no está mapeado
-                    quality_mapping = {
-                        'strong': 'STRONG',
-                        'weak': 'WEAK',
-                        'good': 'GOOD',
-                        'low': 'LOW',
-                        'high': 'HIGH',
-                        'medium': 'MEDIUM'
-                    }
-                    
-                    if quality is not None and quality.text:
-                        normalized_quality = quality_mapping.get(quality.text.strip().lower(), quality.text.strip().upper())
-                    else:
-                        normalized_quality = 'UNKNOWN'
-                    
-                    entity_data['aliases'].append({
-                        'name': alias_name.text.strip(),
-                        'quality': normalized_quality
-                    })
+            entity_data['aliases'] = self.extract_aliases(entity, 'ENTITY_ALIAS')
             
             # Extraer direcciones
-            for address in entity.findall('ENTITY_ADDRESS'):
-                address_parts = []
-                country = ''
-                
-                # Extraer partes de la dirección
-                for field in ['STREET', 'CITY', 'STATE_PROVINCE']:
-                    elem = address.find(field)
-                    if elem is not None and elem.text:
-                        address_parts.append(elem.text.strip())
-                
-                # Extraer país
-                country_elem = address.find('COUNTRY')
-                if country_elem is not None and country_elem.text:
-                    country = country_elem.text.strip()
-                    address_parts.append(country)
-                
-                if address_parts:
-                    entity_data['addresses'].append({
-                        'full_address': ', '.join(address_parts),
-                        'country': country
-                    })
+            entity_data['addresses'] = self.extract_addresses(entity, 'ENTITY_ADDRESS')
         
         except Exception as e:
             logger.error(f"Error extrayendo datos de entidad: {e}")
@@ -339,45 +300,16 @@ class UNParserFinal:
             individuals = root.findall('.//INDIVIDUAL')
             logger.info(f"Encontrados {len(individuals)} individuos en el XML")
             
-            for individual in individuals:
-                try:
-                    entity_data = self.extract_individual_data(individual)
-                    
-                    if entity_data['name']:  # Solo procesar si tiene nombre
-                        self.process_entity(entity_data)
-                        processed_count += 1
-                        
-                        if processed_count % 100 == 0:
-                            logger.info(f"Procesadas {processed_count} entidades...")
-                            self.db.commit()
-                
-                except Exception as e:
-                    logger.error(f"Error procesando individuo: {e}")
-                    self.stats['errors'].append(str(e))
-                    continue
+            processed_count = self.process_elements(individuals, self.extract_individual_data, 'individuo', processed_count)
             
             # Procesar entidades
             entities = root.findall('.//ENTITY')
             logger.info(f"Encontradas {len(entities)} entidades en el XML")
             
-            for entity in entities:
-                try:
-                    entity_data = self.extract_entity_data(entity)
-                    
-                    if entity_data['name']:  # Solo procesar si tiene nombre
-                        self.process_entity(entity_data)
-                        processed_count += 1
-                        
-                        if processed_count % 100 == 0:
-                            logger.info(f"Procesadas {processed_count} entidades...")
-                            self.db.commit()
-                
-                except Exception as e:
-                    logger.error(f"Error procesando entidad: {e}")
-                    self.stats['errors'].append(str(e))
-                    continue
+            processed_count = self.process_elements(entities, self.extract_entity_data, 'entidad', processed_count)
             
             # Commit final
+            self.flush_births()
             self.db.commit()
             logger.info(f"Procesamiento completado. Total entidades: {processed_count}")
             return True
@@ -387,14 +319,79 @@ class UNParserFinal:
             self.db.rollback()
             return False
     
-    def process_entity(self, entity_data: Dict) -> Entity:
+    def process_elements(self, elements, extract_data, label: str, processed_count: int) -> int:
+        """Procesar elementos XML por lotes de ENTITY_BATCH_SIZE (un IN de existencia y un commit por lote)"""
+        for start in range(0, len(elements), ENTITY_BATCH_SIZE):
+            batch = []
+            for element in elements[start:start + ENTITY_BATCH_SIZE]:
+                try:
+                    entity_data = extract_data(element)
+                    
+                    if entity_data['name']:  # Solo procesar si tiene nombre
+                        batch.append(entity_data)
+                
+                except Exception as e:
+                    logger.error(f"Error procesando {label}: {e}")
+                    self.stats['errors'].append(str(e))
+            
+            existing = self.load_existing_entities([data['source_id'] for data in batch])
+            for entity_data in batch:
+                try:
+                    self.process_entity(entity_data, existing)
+                    processed_count += 1
+                
+                except Exception as e:
+                    logger.error(f"Error procesando {label}: {e}")
+                    self.stats['errors'].append(str(e))
+            
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Procesadas %d entidades...", processed_count)
+            self.flush_births()
+            self.db.commit()
+        
+        return processed_count
+    
+    def load_existing_entities(self, source_ids: List[str]) -> Dict[str, Entity]:
+        """Entidades ONU ya guardadas del lote (con sus relaciones), por source_id"""
+        if not source_ids:
+            return {}
+        
+        entities = self.db.scalars(
+            select(Entity)
+            .where(Entity.source == 'UN', Entity.source_id.in_(source_ids))
+            .options(
+                selectinload(Entity.aliases), selectinload(Entity.addresses),
+                selectinload(Entity.documents), selectinload(Entity.nationalities),
+                selectinload(Entity.sanctions)
+            )
+        ).all()
+        return {entity.source_id: entity for entity in entities}
+    
+    def flush_births(self):
+        """Insertar los nacimientos acumulados con un único INSERT multi-fila"""
+        if not self.birth_entity_ids:
+            return
+        
+        self.db.execute(insert(Birth.__table__), [
+            {'entity_id': entity_id, 'dob': dob, 'pob': pob}
+            for entity_id, dob, pob in zip(self.birth_entity_ids, self.birth_dobs, self.birth_pobs)
+        ])
+        
+        self.birth_entity_ids.clear()
+        self.birth_dobs.clear()
+        self.birth_pobs.clear()
+    
+    def process_entity(self, entity_data: Dict, existing: Optional[Dict[str, Entity]] = None) -> Entity:
         """Procesar y guardar una entidad en la base de datos"""
         try:
-            # Verificar si la entidad ya existe
-            existing_entity = self.db.query(Entity).filter(
-                Entity.source == 'UN',
-                Entity.source_id == entity_data['source_id']
-            ).first()
+            # Verificar si la entidad ya existe (en el lote precargado o con una consulta)
+            if existing is not None:
+                existing_entity = existing.get(entity_data['source_id'])
+            else:
+                existing_entity = self.db.query(Entity).filter(
+                    Entity.source == 'UN',
+                    Entity.source_id == entity_data['source_id']
+                ).first()
             
             if existing_entity:
                 # Actualizar entidad existente
@@ -433,10 +430,14 @@ class UNParserFinal:
                     resolution=entity_data.get('resolution', ''),
                     listed_on=entity_data.get('listed_on'),
                     status='ACTIVE',
-                    hash_signature=hashlib.md5(str(entity_data).encode()).hexdigest()
+                    hash_signature=content_hash(str(entity_data))
                 )
                 self.db.add(entity)
                 self.stats['entities_added'] += 1
+                
+                # Un source_id repetido en el XML actualiza la entidad recién creada
+                if existing is not None:
+                    existing[entity_data['source_id']] = entity
             
             # Flush para obtener el ID
             self.db.flush()
@@ -481,13 +482,11 @@ class UNParserFinal:
                 self.db.add(nationality)
             
             # Agregar información de nacimiento
-            if entity_data['birth_info']:
-                birth = Birth(
-                    entity_id=entity.id,
-                    dob=entity_data['birth_info'].get('dob', ''),
-                    pob=entity_data['birth_info'].get('pob', '')
-                )
-                self.db.add(birth)
+            # (se acumula y se inserta en bloque al cerrar cada lote, ver flush_births)
+            if entity_data['birth_dob'] or entity_data['birth_pob']:
+                self.birth_entity_ids.append(entity.id)
+                self.birth_dobs.append(entity_data['birth_dob'])
+                self.birth_pobs.append(entity_data['birth_pob'])
             
             # Agregar sanción
             sanction = Sanction(
@@ -512,16 +511,28 @@ class UNParserFinal:
         start_time = datetime.utcnow()
         
         try:
+            # Última actualización exitosa: sus validadores HTTP permiten un GET condicional
+            last_update = self.db.query(UpdateLog).filter(
+                UpdateLog.source == 'UN',
+                UpdateLog.status == 'SUCCESS'
+            ).order_by(UpdateLog.update_date.desc()).first()
+            
             # Descargar datos
-            xml_content = self.download_un_data(settings.un_consolidated_url)
+            xml_content = self.download_un_data(
+                settings.un_consolidated_url,
+                etag=last_update.etag if last_update else None,
+                last_modified=last_update.last_modified if last_update else None
+            )
+            
+            if self.not_modified:
+                logger.info("No hay cambios en los datos de ONU")
+                return {'status': 'no_changes', 'hash': last_update.file_hash}
+            
             if not xml_content:
                 raise Exception("No se pudo descargar el archivo XML")
             
-            # Verificar cambios
+            # Verificar cambios (para servidores que no soportan GET condicional)
             file_hash = self.calculate_hash(xml_content)
-            last_update = self.db.query(UpdateLog).filter(
-                UpdateLog.source == 'UN'
-            ).order_by(UpdateLog.update_date.desc()).first()
             
             if last_update and last_update.file_hash == file_hash:
                 logger.info("No hay cambios en los datos de ONU")
@@ -538,6 +549,8 @@ class UNParserFinal:
                 records_updated=self.stats['entities_updated'],
                 records_deleted=self.stats['entities_deleted'],
                 file_hash=file_hash,
+                etag=self.etag,
+                last_modified=self.last_modified,
                 status='SUCCESS' if success else 'FAILED',
                 error_message='; '.join(self.stats['errors']) if self.stats['errors'] else None
             )
@@ -545,6 +558,10 @@ class UNParserFinal:
             self.db.add(update_log)
             self.db.commit()
             
+            # Recalcular las estadísticas precalculadas con los nuevos datos
+            if success:
+                refresh_db_stats(self.db, exact=True)
+            
             return {
                 'status': 'success' if success else 'failed',
                 'stats': self.stats,
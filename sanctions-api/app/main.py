@@ -1,19 +1,27 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import logging
-from datetime import datetime, date
-from sqlalchemy import func
+import time
+import asyncio
+import orjson
+from datetime import date
 
-from app.models.database import get_db
+from app.models.database import (
+    get_async_db, SessionLocal, async_engine, dialect_insert,
+    begin_request_session, end_request_session, upgrade_schema
+)
 from app.core.config import settings
 from app.api.routes import router as api_router
 from app.api.etl_routes import etl_router
 from app.api.admin_routes import admin_router  # NUEVO: Importar rutas de admin
-from app.models.entities import ApiUsage, Client
+from app.models.entities import ApiUsage, ClientMonthlyUsage
+from app.core.client_cache import CachedClient, get_client_by_api_key, get_monthly_usage
+from app.core.usage_counter import usage_counter
+from app.core.db_stats import DB_STATS_REFRESH_INTERVAL, refresh_db_stats
 
 # Configurar logging
 logging.basicConfig(
@@ -28,110 +36,243 @@ app = FastAPI(
     version=settings.version,
     description="API para consulta de listas de sanciones OFAC y ONU",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse  # Serialización con orjson (fechas nativas, sin json.dumps)
 )
 
 # Configurar CORS
+# Lista de orígenes permitidos, parseada una sola vez al arrancar (búsqueda O(1))
+CORS_ORIGINS = frozenset(
+    origin.strip() for origin in settings.cors_origins.split(",") if origin.strip()
+)
+
+# Nota: Starlette envuelve en orden inverso al registro, así que CORS (registrado
+# primero) queda como la capa más interna, por debajo de log_requests
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # En producción, especificar dominios exactos
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT"],
+    allow_headers=["X-API-Key", "X-Admin-Key", "Content-Type"],
+    max_age=600,  # Cachear preflights en el navegador
 )
 
+# Cola de uso de la API: el middleware solo encola y un flusher escribe en lotes
+USAGE_QUEUE_MAXSIZE = 10000
+USAGE_BATCH_SIZE = 500
+USAGE_FLUSH_INTERVAL = 1.0  # segundos
+
+def write_usage_batch(batch: List[tuple]):
+    """Agregar un lote de consultas por (cliente, día) y escribirlo con un único UPSERT"""
+    if not batch:
+        return
+    
+    totals = {}
+    monthly_totals = {}
+    for client_id, plan_type, query_date, endpoint in batch:
+        row = totals.get((client_id, query_date))
+        if row:
+            row['queries_count'] += 1
+        else:
+            totals[(client_id, query_date)] = {
+                'client_id': client_id,
+                'query_date': query_date,
+                'queries_count': 1,
+                'plan_type': plan_type,
+                'endpoint': endpoint
+            }
+        
+        month_key = (client_id, query_date.strftime('%Y-%m'))
+        monthly_totals[month_key] = monthly_totals.get(month_key, 0) + 1
+    
+    with SessionLocal() as db:
+        try:
+            insert = dialect_insert(db)
+            
+            # Contadores diarios
+            stmt = insert(ApiUsage).values(list(totals.values()))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['client_id', 'query_date'],
+                set_={'queries_count': ApiUsage.queries_count + stmt.excluded.queries_count}
+            )
+            db.execute(stmt)
+            
+            # Rollup mensual (lo que lee validate_api_key)
+            stmt = insert(ClientMonthlyUsage).values([
+                {'client_id': client_id, 'year_month': year_month, 'total': total}
+                for (client_id, year_month), total in monthly_totals.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['client_id', 'year_month'],
+                set_={'total': ClientMonthlyUsage.total + stmt.excluded.total}
+            )
+            db.execute(stmt)
+            
+            db.commit()
+            logger.info(f"Uso registrado: {len(batch)} consultas de {len(totals)} cliente(s)")
+            
+        except Exception as e:
+            logger.error(f"Error registrando uso: {e}")
+            db.rollback()
+
+async def usage_flusher(queue: asyncio.Queue):
+    """Vaciar la cola cada USAGE_BATCH_SIZE eventos o USAGE_FLUSH_INTERVAL segundos"""
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        batch = []
+        
+        try:
+            batch.append(await queue.get())
+            deadline = loop.time() + USAGE_FLUSH_INTERVAL
+            
+            while len(batch) < USAGE_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+                
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Apagado: no perder el lote parcial
+            write_usage_batch(batch)
+            raise
+        
+        # La escritura bloqueante se hace fuera del event loop
+        await asyncio.to_thread(write_usage_batch, batch)
+
+@app.on_event("startup")
+async def upgrade_schema_on_startup():
+    """Crear las tablas nuevas (client_monthly_usage, db_stats...), migrar las existentes y
+    asegurar las particiones del mes (por si el scheduler no corrió el día 1).
+    Debe registrarse antes que el flusher y el refresco de db_stats"""
+    try:
+        await asyncio.to_thread(upgrade_schema)
+    except Exception as e:
+        logger.error(f"No se pudo actualizar el esquema de la BD: {e}")
+        raise
+
+@app.on_event("startup")
+async def start_usage_flusher():
+    app.state.usage_queue = asyncio.Queue(maxsize=USAGE_QUEUE_MAXSIZE)
+    app.state.usage_flusher = asyncio.create_task(usage_flusher(app.state.usage_queue))
+
+def refresh_db_stats_once():
+    with SessionLocal() as db:
+        refresh_db_stats(db)
+
+async def db_stats_refresher():
+    """Refrescar la fila de db_stats cada DB_STATS_REFRESH_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(DB_STATS_REFRESH_INTERVAL)
+        await asyncio.to_thread(refresh_db_stats_once)
+
+@app.on_event("startup")
+async def start_db_stats_refresher():
+    # Primera lectura antes de aceptar peticiones: /info y /stats ya encuentran la fila
+    await asyncio.to_thread(refresh_db_stats_once)
+    app.state.db_stats_refresher = asyncio.create_task(db_stats_refresher())
+
+@app.on_event("shutdown")
+async def stop_db_stats_refresher():
+    app.state.db_stats_refresher.cancel()
+    try:
+        await app.state.db_stats_refresher
+    except asyncio.CancelledError:
+        pass
+
+@app.on_event("shutdown")
+async def stop_usage_flusher():
+    app.state.usage_flusher.cancel()
+    try:
+        await app.state.usage_flusher
+    except asyncio.CancelledError:
+        pass
+    
+    # Escribir lo que quede en la cola
+    queue = app.state.usage_queue
+    remaining = []
+    while not queue.empty():
+        remaining.append(queue.get_nowait())
+    write_usage_batch(remaining)
+    
+    # Cerrar las conexiones del pool asíncrono y del contador de uso
+    await async_engine.dispose()
+    await usage_counter.close()
+
+# Único prefijo cuyo uso se contabiliza
+SEARCH_PREFIX = f"{settings.api_v1_prefix}/search"
+
 # NUEVO: Middleware para rastrear uso de la API
 @app.middleware("http")
 async def track_api_usage(request, call_next):
     """Middleware para registrar uso de la API"""
     
+    # Camino rápido: /, /health, /docs, etc. no se contabilizan
+    if not request.url.path.startswith(SEARCH_PREFIX):
+        return await call_next(request)
+    
     # Procesar la request
     response = await call_next(request)
     
-    # Solo rastrear endpoints de búsqueda exitosos
-    if (request.url.path.startswith(f"{settings.api_v1_prefix}/search") and 
+    # validate_api_key deja el cliente autenticado en request.state
+    client_id = getattr(request.state, "client_id", None)
+    
+    # Solo rastrear búsquedas exitosas de clientes autenticados
+    if (client_id and
         response.status_code == 200 and
         request.method == "GET"):
         
+        today = date.today()
+        
+        # Contador de cuota (Redis o memoria): una sola operación, sin transacción SQL
+        await usage_counter.incr(client_id, today.strftime('%Y-%m'))
+        
+        # No bloqueante: la escritura en BD la hace usage_flusher
         try:
-            # Obtener API Key
-            api_key = request.headers.get("X-API-Key")
-            
-            if api_key:
-                # Crear nueva sesión de DB para el middleware
-                from app.models.database import SessionLocal
-                db = SessionLocal()
-                
-                try:
-                    # Buscar cliente
-                    client = db.query(Client).filter(
-                        Client.api_key == api_key,
-                        Client.is_active == True
-                    ).first()
-                    
-                    if client:
-                        today = date.today()
-                        
-                        # Buscar registro existente para hoy
-                        usage_record = db.query(ApiUsage).filter(
-                            ApiUsage.client_id == client.client_id,
-                            ApiUsage.query_date == today
-                        ).first()
-                        
-                        if usage_record:
-                            # Incrementar contador existente
-                            usage_record.queries_count += 1
-                        else:
-                            # Crear nuevo registro para hoy
-                            usage_record = ApiUsage(
-                                client_id=client.client_id,
-                                query_date=today,
-                                queries_count=1,
-                                plan_type=client.plan_type,
-                                endpoint=str(request.url.path)
-                            )
-                            db.add(usage_record)
-                        
-                        db.commit()
-                        logger.info(f"Uso registrado para cliente: {client.client_id} (total hoy: {usage_record.queries_count})")
-                        
-                except Exception as e:
-                    logger.error(f"Error registrando uso: {e}")
-                    db.rollback()
-                finally:
-                    db.close()
-                    
-        except Exception as e:
-            logger.error(f"Error en middleware de tracking: {e}")
+            request.app.state.usage_queue.put_nowait(
+                (client_id, request.state.plan_type, today, str(request.url.path))
+            )
+        except asyncio.QueueFull:
+            logger.warning(f"Cola de uso llena, consulta de {client_id} no registrada")
     
     return response
 
 # Middleware para logging de requests (mantener el existente)
 @app.middleware("http")
 async def log_requests(request, call_next):
-    start_time = datetime.now()
+    start_ns = time.perf_counter_ns()
     response = await call_next(request)
-    process_time = (datetime.now() - start_time).total_seconds()
     
-    logger.info(
-        f"{request.method} {request.url.path} - "
-        f"Status: {response.status_code} - "
-        f"Time: {process_time:.3f}s"
-    )
+    # Formatear solo si el nivel INFO está activo
+    if logger.isEnabledFor(logging.INFO):
+        process_ms = (time.perf_counter_ns() - start_ns) / 1e6
+        logger.info(
+            "%s %s - Status: %s - Time: %.3fms",
+            request.method, request.url.path, response.status_code, process_ms
+        )
     return response
 
+# Sesión de BD por request (registrado al final: es la capa más externa)
+@app.middleware("http")
+async def db_session_scope(request, call_next):
+    token = begin_request_session()
+    try:
+        return await call_next(request)
+    finally:
+        end_request_session(token)
+
 # Función para validar API Key (mantener la existente)
 async def validate_api_key(
+    request: Request,
     x_api_key: str = Header(..., description="API Key para autenticación"),
-    db: Session = Depends(get_db)
-) -> Client:
+    db: AsyncSession = Depends(get_async_db)
+) -> CachedClient:
     """Validar API Key y verificar límites de suscripción"""
     
-    # Buscar cliente por API Key
-    client = db.query(Client).filter(
-        Client.api_key == x_api_key,
-        Client.is_active == True
-    ).first()
+    # Buscar cliente por API Key (caché en proceso, evita un SELECT por request)
+    client = await get_client_by_api_key(db, x_api_key)
     
     if not client:
         raise HTTPException(
@@ -141,14 +282,13 @@ async def validate_api_key(
     
     # Verificar límites de uso mensual
     if client.monthly_quota > 0:  # -1 significa ilimitado
-        today = date.today()
-        month_start = today.replace(day=1)
+        # Uso del mes actual desde el contador; en un fallo se inicializa desde la BD
+        year_month = date.today().strftime('%Y-%m')
+        monthly_usage = await usage_counter.get(client.client_id, year_month)
         
-        # Contar uso del mes actual
-        monthly_usage = db.query(func.sum(ApiUsage.queries_count)).filter(
-            ApiUsage.client_id == client.client_id,
-            ApiUsage.query_date >= month_start
-        ).scalar() or 0
+        if monthly_usage is None:
+            monthly_usage = await get_monthly_usage(db, client.client_id, year_month)
+            await usage_counter.backfill(client.client_id, year_month, monthly_usage)
         
         if monthly_usage >= client.monthly_quota:
             raise HTTPException(
@@ -156,6 +296,10 @@ async def validate_api_key(
                 detail=f"Límite mensual alcanzado ({client.monthly_quota} consultas)"
             )
     
+    # Exponer el cliente a track_api_usage sin volver a consultarlo
+    request.state.client_id = client.client_id
+    request.state.plan_type = client.plan_type
+    
     return client
 
 # Incluir rutas de la API (mantener las existentes)
@@ -180,44 +324,53 @@ app.include_router(
     tags=["Administration"]
 )
 
+# Respuestas estáticas precalculadas (se serializan una sola vez al importar el módulo)
+ROOT_BYTES = orjson.dumps({
+    "message": "Sanctions API",
+    "version": settings.version,
+    "docs": "/docs",
+    "status": "active"
+})
+
+INFO_BYTES = orjson.dumps({
+    "name": settings.app_name,
+    "version": settings.version,
+    "description": "API para consulta de listas de sanciones internacionales",
+    "sources": ["OFAC", "UN"],
+    "endpoints": {
+        "search": f"{settings.api_v1_prefix}/search",
+        "entity": f"{settings.api_v1_prefix}/entity/{{id}}",
+        "stats": f"{settings.api_v1_prefix}/stats",
+        "admin": f"{settings.api_v1_prefix}/admin"  # NUEVO
+    },
+    "authentication": "API Key required in X-API-Key header (X-Admin-Key for admin endpoints)"
+})
+
 # Rutas básicas (mantener las existentes)
 @app.get("/")
 async def root():
-    return {
-        "message": "Sanctions API",
-        "version": settings.version,
-        "docs": "/docs",
-        "status": "active"
-    }
+    return Response(ROOT_BYTES, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "version": settings.version
-    }
+    # Solo el timestamp cambia entre llamadas (epoch en segundos)
+    return Response(
+        orjson.dumps({
+            "status": "healthy",
+            "timestamp": time.time(),
+            "version": settings.version
+        }),
+        media_type="application/json"
+    )
 
 @app.get("/info")
 async def api_info():
-    return {
-        "name": settings.app_name,
-        "version": settings.version,
-        "description": "API para consulta de listas de sanciones internacionales",
-        "sources": ["OFAC", "UN"],
-        "endpoints": {
-            "search": f"{settings.api_v1_prefix}/search",
-            "entity": f"{settings.api_v1_prefix}/entity/{{id}}",
-            "stats": f"{settings.api_v1_prefix}/stats",
-            "admin": f"{settings.api_v1_prefix}/admin"  # NUEVO
-        },
-        "authentication": "API Key required in X-API-Key header (X-Admin-Key for admin endpoints)"
-    }
+    return Response(INFO_BYTES, media_type="application/json")
 
 # Manejo de errores (mantener existentes)
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={"detail": "Recurso no encontrado"}
     )
@@ -225,7 +378,7 @@ async def not_found_handler(request, exc):
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
     logger.error(f"Error interno: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Error interno del servidor"}
     )
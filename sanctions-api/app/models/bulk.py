@@ -0,0 +1,52 @@
+# app/models/bulk.py
+"""
+Cargas masivas: COPY en PostgreSQL para lotes grandes, INSERT multi-fila en el resto
+"""
+import csv
+import io
+from typing import Any, Dict, List, Sequence
+from sqlalchemy import insert, Table
+from sqlalchemy.orm import Session
+
+# A partir de este número de filas compensa abrir un COPY
+COPY_THRESHOLD = 100
+
+# Marcador de NULL en el CSV (una cadena vacía es un valor, no NULL)
+COPY_NULL = r'\N'
+
+def bulk_copy(session: Session, table_name: str, rows: Sequence[Sequence[Any]], columns: List[str]) -> None:
+    """Volcar filas con COPY ... FROM STDIN (psycopg2) dentro de la transacción de la sesión"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='\t', lineterminator='\n')
+    writer.writerows(
+        [COPY_NULL if value is None else value for value in row]
+        for row in rows
+    )
+    buffer.seek(0)
+    
+    # Las filas padre pendientes deben existir antes del COPY
+    session.flush()
+    
+    # Formato CSV: tabuladores y saltos de línea dentro de los textos van entrecomillados
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN "
+            f"WITH (FORMAT csv, DELIMITER E'\\t', NULL '{COPY_NULL}')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def bulk_insert(session: Session, table: Table, rows: List[Dict[str, Any]]) -> int:
+    """Insertar filas (dicts con las mismas claves) usando COPY cuando el lote es grande"""
+    if not rows:
+        return 0
+    
+    if len(rows) >= COPY_THRESHOLD and session.get_bind().dialect.name == "postgresql":
+        columns = list(rows[0].keys())
+        bulk_copy(session, table.name, [[row[column] for column in columns] for row in rows], columns)
+    else:
+        session.execute(insert(table), rows)
+    
+    return len(rows)
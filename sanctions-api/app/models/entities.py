@@ -1,5 +1,5 @@
 # app/models/entities.py
-from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Boolean, Index
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Boolean, Index, DDL, JSON, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -37,18 +37,30 @@ class Entity(Base):
     
     # Índices para optimización
     __table_args__ = (
-        Index('idx_entities_source', 'source', 'source_id'),
-        Index('idx_entities_name', 'name'),
-        Index('idx_entities_status', 'status'),
+        # Búsqueda por (source, source_id) del ETL. Sin INCLUDE: el ETL carga la entidad completa
+        # para actualizarla (no habría index-only scan) y remarks (Text) superaría el límite del B-tree
+        Index('ix_entities_source_sid', 'source', 'source_id'),
+        # Trigramas para los ILIKE '%...%' de la búsqueda (solo PostgreSQL; un B-tree sobre Text no sirve)
+        Index('idx_entities_name_trgm', 'name',
+              postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Filtros combinados de la búsqueda (fuente, estado, tipo)
+        Index('idx_entities_src_status', 'source', 'status', 'type'),
         Index('idx_entities_type', 'type'),
         Index('idx_entities_updated', 'last_updated'),
     )
 
+# El índice de trigramas requiere la extensión pg_trgm
+event.listen(
+    Entity.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
 class Alias(Base):
     __tablename__ = "aliases"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     alias_name = Column(Text, nullable=False)
     quality = Column(String(20))  # strong, weak, good, etc.
     language = Column(String(10))
@@ -59,14 +71,13 @@ class Alias(Base):
     # Índices
     __table_args__ = (
         Index('idx_aliases_name', 'alias_name'),
-        Index('idx_aliases_entity', 'entity_id'),
     )
 
 class Document(Base):
     __tablename__ = "documents"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     doc_type = Column(String(30), nullable=False)
     doc_number = Column(String(100), nullable=False)
     issuer = Column(String(50))
@@ -79,14 +90,13 @@ class Document(Base):
     __table_args__ = (
         Index('idx_documents_number', 'doc_number'),
         Index('idx_documents_type', 'doc_type'),
-        Index('idx_documents_entity', 'entity_id'),
     )
 
 class Address(Base):
     __tablename__ = "addresses"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     full_address = Column(Text)
     city = Column(String(50))
     region = Column(String(50))
@@ -100,14 +110,13 @@ class Address(Base):
     __table_args__ = (
         Index('idx_addresses_country', 'country'),
         Index('idx_addresses_city', 'city'),
-        Index('idx_addresses_entity', 'entity_id'),
     )
 
 class Birth(Base):
     __tablename__ = "births"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     dob = Column(String(50))  # Puede ser fecha parcial o texto
     pob = Column(Text)  # Place of birth
     
@@ -118,7 +127,7 @@ class Nationality(Base):
     __tablename__ = "nationalities"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     country = Column(String(50), nullable=False)
     
     # Relación
@@ -127,14 +136,13 @@ class Nationality(Base):
     # Índices
     __table_args__ = (
         Index('idx_nationalities_country', 'country'),
-        Index('idx_nationalities_entity', 'entity_id'),
     )
 
 class Sanction(Base):
     __tablename__ = "sanctions"
     
     id = Column(Integer, primary_key=True, index=True)
-    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
+    entity_id = Column(Integer, ForeignKey("entities.id"), nullable=False, index=True)
     program = Column(String(100), nullable=False)
     authority = Column(String(50))  # OFAC, UN, etc.
     listing_date = Column(Date)
@@ -148,7 +156,6 @@ class Sanction(Base):
     __table_args__ = (
         Index('idx_sanctions_program', 'program'),
         Index('idx_sanctions_authority', 'authority'),
-        Index('idx_sanctions_entity', 'entity_id'),
     )
 
 class Relationship(Base):
@@ -183,12 +190,15 @@ class UpdateLog(Base):
     records_updated = Column(Integer, default=0)
     records_deleted = Column(Integer, default=0)
     file_hash = Column(String(64))
+    etag = Column(String(200))  # ETag devuelto por la fuente (GET condicional)
+    last_modified = Column(String(100))  # Cabecera Last-Modified de la fuente
     status = Column(String(20), default='SUCCESS')  # SUCCESS, FAILED, PARTIAL
     error_message = Column(Text)
     
     # Índices
     __table_args__ = (
-        Index('idx_update_logs_source', 'source'),
+        # Listados por fuente ya ordenados por fecha (sustituye al índice solo por source)
+        Index('idx_update_logs_src_date_status', 'source', update_date.desc(), 'status'),
         Index('idx_update_logs_date', 'update_date'),
         Index('idx_update_logs_status', 'status'),
     )
@@ -197,20 +207,45 @@ class ApiUsage(Base):
     """Control de uso de API para suscripciones"""
     __tablename__ = "api_usage"
     
-    id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(String(50), nullable=False)
-    query_date = Column(Date, default=func.current_date())
+    # Un registro por cliente y día (objetivo del UPSERT del flusher de uso).
+    # La clave incluye query_date porque PostgreSQL lo exige en tablas particionadas.
+    client_id = Column(String(50), primary_key=True)
+    query_date = Column(Date, primary_key=True, default=func.current_date())
     queries_count = Column(Integer, default=0)
     plan_type = Column(String(20), nullable=False)
     endpoint = Column(String(100))
     
     # Índices
     __table_args__ = (
-        Index('idx_api_usage_client', 'client_id'),
-        Index('idx_api_usage_date', 'query_date'),
+        # Cubre las sumas por rango de fechas (index-only scan en PostgreSQL)
+        Index('idx_api_usage_month', 'client_id', 'query_date', postgresql_include=['queries_count']),
         Index('idx_api_usage_plan', 'plan_type'),
+        # Una partición por mes (ver app/models/partitions.py)
+        {'postgresql_partition_by': 'RANGE (query_date)'},
     )
 
+class ClientMonthlyUsage(Base):
+    """Totales de uso mensual por cliente (rollup de api_usage)"""
+    __tablename__ = "client_monthly_usage"
+    
+    client_id = Column(String(50), primary_key=True)
+    year_month = Column(String(7), primary_key=True)  # YYYY-MM
+    total = Column(Integer, nullable=False, default=0)
+
+class DbStats(Base):
+    """Estadísticas precalculadas de la BD (fila única, id=1)"""
+    __tablename__ = "db_stats"
+    
+    id = Column(Integer, primary_key=True)
+    total_entities = Column(Integer, default=0)
+    total_aliases = Column(Integer, default=0)
+    total_addresses = Column(Integer, default=0)
+    total_documents = Column(Integer, default=0)
+    entities_by_source = Column(JSON)
+    entities_by_type = Column(JSON)
+    last_update = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class Client(Base):
     """Tabla de clientes y suscripciones"""
     __tablename__ = "clients"
@@ -227,7 +262,7 @@ class Client(Base):
     
     # Índices
     __table_args__ = (
-        Index('idx_clients_api_key', 'api_key'),
+        Index('idx_clients_apikey_active', 'api_key', 'is_active'),
         Index('idx_clients_client_id', 'client_id'),
         Index('idx_clients_active', 'is_active'),
     )
\ No newline at end of file
@@ -0,0 +1,46 @@
+# app/models/migrations.py
+"""
+Cambios de esquema sobre BDs existentes (create_all solo crea tablas que no existen)
+"""
+import logging
+from typing import List
+from sqlalchemy import inspect, text
+
+from app.models.database import engine
+
+logger = logging.getLogger(__name__)
+
+def _added_columns():
+    # Columnas añadidas a tablas ya desplegadas (deben admitir NULL)
+    from app.models.entities import UpdateLog
+    return [
+        UpdateLog.__table__.c.etag,
+        UpdateLog.__table__.c.last_modified,
+    ]
+
+def add_missing_columns() -> List[str]:
+    """ALTER TABLE ... ADD COLUMN para las columnas nuevas que falten (idempotente)"""
+    inspector = inspect(engine)
+    added = []
+    
+    with engine.begin() as conn:
+        for column in _added_columns():
+            table = column.table.name
+            existing = {col['name'] for col in inspector.get_columns(table)}
+            if column.name in existing:
+                continue
+            
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+            added.append(f"{table}.{column.name}")
+    
+    if added:
+        logger.info(f"Columnas añadidas: {', '.join(added)}")
+    return added
+
+def create_missing_indexes() -> None:
+    """Crea los índices declarados que falten en tablas ya existentes"""
+    from app.models.entities import Base
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,170 @@
+# app/models/partitions.py
+"""
+Mantenimiento de las particiones mensuales de api_usage (solo PostgreSQL)
+y migración del esquema anterior de api_usage
+"""
+import logging
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import inspect, text
+
+from app.core.config import settings
+from app.models.database import engine
+
+logger = logging.getLogger(__name__)
+
+def month_start(day: date, offset: int = 0) -> date:
+    """Primer día del mes de `day` desplazado `offset` meses"""
+    month_index = day.year * 12 + day.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_name(start: date) -> str:
+    return f"api_usage_{start:%Y_%m}"
+
+# Recoge las filas de meses sin partición (p. ej. si el scheduler no corrió el día 1)
+DEFAULT_PARTITION = "api_usage_default"
+
+def _create_partition(conn, start: date) -> bool:
+    """Crear la partición del mes `start` moviendo las filas que hubiera en la DEFAULT"""
+    name = partition_name(start)
+    if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None:
+        return False
+    
+    end = month_start(start, 1)
+    
+    # Con filas del mes en la DEFAULT, CREATE ... PARTITION OF fallaría: se crea aparte,
+    # se trasladan las filas y se adjunta (los índices del padre se crean al adjuntar)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE api_usage INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE query_date >= :start AND query_date < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {'start': start, 'end': end})
+    conn.execute(text(
+        f"ALTER TABLE api_usage ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return True
+
+def _ensure_partitions(conn, months_ahead: int, since: Optional[date]) -> List[str]:
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF api_usage DEFAULT"))
+    
+    current = month_start(since or date.today())
+    last = month_start(date.today(), months_ahead)
+    created = []
+    
+    while current <= last:
+        if _create_partition(conn, current):
+            created.append(partition_name(current))
+        current = month_start(current, 1)
+    
+    return created
+
+def ensure_usage_partitions(months_ahead: int = 1, since: Optional[date] = None) -> List[str]:
+    """Crear la partición DEFAULT y las mensuales desde `since` (o el mes actual) hasta `months_ahead` meses"""
+    if engine.dialect.name != "postgresql":
+        return []
+    
+    with engine.begin() as conn:
+        created = _ensure_partitions(conn, months_ahead, since)
+    
+    if created:
+        logger.info(f"Particiones de api_usage creadas: {', '.join(created)}")
+    return created
+
+def detach_old_usage_partitions(retention_months: Optional[int] = None) -> List[str]:
+    """Separar (sin borrar) las particiones anteriores al periodo de retención"""
+    if engine.dialect.name != "postgresql":
+        return []
+    
+    retention_months = retention_months or settings.usage_retention_months
+    cutoff = partition_name(month_start(date.today(), -retention_months))
+    detached = []
+    
+    with engine.begin() as conn:
+        partitions = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'api_usage'"
+        )).scalars().all()
+        
+        # api_usage_YYYY_MM ordena cronológicamente como texto
+        for name in sorted(partitions):
+            if name != DEFAULT_PARTITION and name < cutoff:
+                conn.execute(text(f"ALTER TABLE api_usage DETACH PARTITION {name}"))
+                detached.append(name)
+    
+    if detached:
+        logger.info(f"Particiones de api_usage separadas: {', '.join(detached)}")
+    return detached
+
+# El esquema anterior admitía varias filas por cliente y día: se agregan para la nueva PK
+_COPY_OLD_USAGE = text(
+    "INSERT INTO api_usage (client_id, query_date, queries_count, plan_type, endpoint) "
+    "SELECT client_id, query_date, sum(queries_count), max(plan_type), max(endpoint) "
+    "FROM api_usage_old WHERE query_date IS NOT NULL "
+    "GROUP BY client_id, query_date"
+)
+
+def _rebuild_usage_table() -> int:
+    """Resto de motores (SQLite): recrear api_usage con la PK (client_id, query_date)"""
+    from app.models.entities import ApiUsage
+    
+    inspector = inspect(engine)
+    if not inspector.has_table("api_usage"):
+        return 0
+    primary_key = inspector.get_pk_constraint("api_usage")['constrained_columns']
+    if primary_key == ['client_id', 'query_date']:
+        return 0
+    old_indexes = [index['name'] for index in inspector.get_indexes("api_usage")]
+    
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE api_usage RENAME TO api_usage_old"))
+        
+        # SQLite conserva los nombres de índice al renombrar la tabla: se eliminan antes de recrearla
+        for index_name in old_indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        
+        ApiUsage.__table__.create(bind=conn)
+        copied = conn.execute(_COPY_OLD_USAGE).rowcount
+        conn.execute(text("DROP TABLE api_usage_old"))
+    
+    logger.info(f"api_usage migrada: {copied} filas")
+    return copied
+
+def migrate_unpartitioned_usage() -> int:
+    """Convertir un api_usage sin particionar (esquema anterior) conservando todo el histórico"""
+    from app.models.entities import ApiUsage
+    
+    if engine.dialect.name != "postgresql":
+        return _rebuild_usage_table()
+    
+    with engine.begin() as conn:
+        partitioned = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'api_usage')"
+        )).scalar()
+        if partitioned:
+            logger.info("api_usage ya está particionada")
+            return 0
+        
+        conn.execute(text("ALTER TABLE api_usage RENAME TO api_usage_old"))
+        
+        # La PK e índices siguen llamándose api_usage_pkey, idx_api_usage_plan...: liberar los nombres
+        old_indexes = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'api_usage_old'"
+        )).scalars().all()
+        for index_name in old_indexes:
+            conn.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_old"))
+        
+        ApiUsage.__table__.create(bind=conn)
+        
+        # Particiones desde el mes más antiguo; las que excedan la retención las separa el scheduler
+        oldest = conn.execute(text("SELECT min(query_date) FROM api_usage_old")).scalar()
+        _ensure_partitions(conn, 1, oldest)
+        
+        copied = conn.execute(_COPY_OLD_USAGE).rowcount
+    
+    logger.info(f"api_usage migrada: {copied} filas (la tabla original queda como api_usage_old)")
+    return copied
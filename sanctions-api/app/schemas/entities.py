@@ -1,5 +1,5 @@
 # app/schemas/entities.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
 from datetime import date, datetime
 from enum import Enum
@@ -40,8 +40,7 @@ class Alias(AliasBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DocumentBase(BaseModel):
     doc_type: str
@@ -53,8 +52,7 @@ class Document(DocumentBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class AddressBase(BaseModel):
     full_address: Optional[str] = None
@@ -67,8 +65,7 @@ class Address(AddressBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class BirthBase(BaseModel):
     dob: Optional[str] = None
@@ -78,8 +75,7 @@ class Birth(BirthBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class NationalityBase(BaseModel):
     country: str
@@ -88,8 +84,7 @@ class Nationality(NationalityBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class SanctionBase(BaseModel):
     program: str
@@ -102,8 +97,7 @@ class Sanction(SanctionBase):
     id: int
     entity_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Schema principal para entidades
 class EntityBase(BaseModel):
@@ -133,8 +127,7 @@ class Entity(EntityBase):
     nationalities: List[Nationality] = []
     sanctions: List[Sanction] = []
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Schema para respuestas de búsqueda
 class SearchMatch(BaseModel):
@@ -147,8 +140,7 @@ class EntitySearchResult(BaseModel):
     entity: Entity
     match_info: SearchMatch
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Schema para respuestas de búsqueda
 class SearchResponse(BaseModel):
@@ -177,8 +169,7 @@ class ClientInfo(BaseModel):
     queries_used_this_month: int
     queries_remaining: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Schema para respuestas de error
 class ErrorResponse(BaseModel):
@@ -2,123 +2,199 @@
 """
 Script para analizar la estructura real del XML de OFAC
 """
+import gzip
+import json
+import re
+import shutil
 import requests
-import xml.etree.ElementTree as ET
+from collections import Counter
+from pathlib import Path
+from lxml import etree
 from app.core.config import settings
 
+# Posible nombre: contiene espacio y mayúsculas, longitud razonable
+NAME_PATTERN = re.compile(r'(?=.*[A-Z])(?=.* ).{4,99}', re.DOTALL)
+
+# Caché local del XML (cuerpo comprimido + cabeceras ETag/Last-Modified)
+CACHE_DIR = Path.home() / '.cache' / 'sanctions'
+CACHE_META = CACHE_DIR / 'ofac.meta'
+CACHE_BODY = CACHE_DIR / 'ofac.xml.gz'
+
+def fetch_ofac_xml():
+    """Descargar el XML de OFAC con GET condicional y devolver el archivo en caché"""
+    
+    headers = {}
+    if CACHE_META.exists() and CACHE_BODY.exists():
+        meta = json.loads(CACHE_META.read_text())
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    
+    with requests.get(settings.ofac_consolidated_url, headers=headers, timeout=60, stream=True) as response:
+        if response.status_code == 304:
+            print("♻️  XML sin cambios, usando caché local")
+        else:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            
+            # Volcar el cuerpo en streaming al archivo comprimido
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_body = CACHE_BODY.with_suffix('.tmp')
+            with gzip.open(tmp_body, 'wb') as f:
+                shutil.copyfileobj(response.raw, f)
+            tmp_body.replace(CACHE_BODY)
+            
+            CACHE_META.write_text(json.dumps({
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }))
+            print(f"📥 XML descargado en {CACHE_BODY}")
+    
+    return gzip.open(CACHE_BODY, 'rb')
+
 def analyze_ofac_structure():
     """Analizar la estructura del XML de OFAC"""
     
     print("🔍 Analizando estructura del XML de OFAC...")
     
-    # Descargar XML
-    response = requests.get(settings.ofac_consolidated_url, timeout=60)
-    xml_content = response.text
+    patterns_to_check = [
+        'distinctParty',
+        'sdnEntry',
+        'entry',
+        'record',
+        'entity',
+        'individual',
+        'person',
+        'organization',
+        'name',
+        'firstName',
+        'lastName'
+    ]
+    
+    max_level = 3
+    root_info = None
+    path = []
+    structure = Counter()          # (ruta del padre, tag) -> elementos
+    structure_attrs = {}           # (ruta del padre, tag) -> atributos del primero
+    tag_counts = Counter()
+    first_examples = {}            # patrón -> resumen del primer elemento
+    open_examples = {}             # elemento abierto -> patrón
+    texts = []
+    text_tags = []
+    
+    # Descargar XML (o reutilizar la caché) sin cargarlo completo en memoria
+    xml_file = fetch_ofac_xml()
+    print(f"📄 Tamaño en caché: {CACHE_BODY.stat().st_size} bytes (gzip)")
+    
+    # Una sola pasada: estructura, patrones y nombres
+    for event, elem in etree.iterparse(xml_file, events=('start', 'end'), huge_tree=True):
+        tag = etree.QName(elem).localname
+        
+        if event == 'start':
+            if root_info is None:
+                root_info = (tag, dict(elem.attrib))
+            
+            if len(path) <= max_level + 1:
+                key = (tuple(path), tag)
+                structure[key] += 1
+                if key not in structure_attrs:
+                    structure_attrs[key] = dict(elem.attrib)
+            
+            if tag in patterns_to_check and tag not in first_examples:
+                first_examples[tag] = {'attrib': dict(elem.attrib), 'children': [], 'text': None}
+                open_examples[elem] = tag
+            
+            path.append(tag)
+            continue
+        
+        path.pop()
+        tag_counts[tag] += 1
+        
+        # Registrar hijos del primer elemento de cada patrón
+        parent = elem.getparent()
+        if parent is not None and parent in open_examples:
+            first_examples[open_examples[parent]]['children'].append(tag)
+        
+        text = elem.text.strip() if elem.text else ''
+        
+        if elem in open_examples:
+            first_examples[open_examples.pop(elem)]['text'] = text
+        
+        if text:
+            texts.append(text)
+            text_tags.append(tag)
+        
+        # Liberar memoria: limpiar el elemento y los hermanos ya procesados
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
     
-    print(f"📄 Tamaño del archivo: {len(xml_content)} caracteres")
+    xml_file.close()
     
-    # Parsear XML
-    root = ET.fromstring(xml_content)
+    print(f"📄 Elementos procesados: {sum(tag_counts.values())}")
     
-    print(f"🌳 Elemento raíz: <{root.tag}>")
-    print(f"   Atributos: {root.attrib}")
+    print(f"🌳 Elemento raíz: <{root_info[0]}>")
+    print(f"   Atributos: {root_info[1]}")
     
     # Analizar estructura nivel por nivel
     print("\n📊 Estructura del XML:")
     
-    def analyze_element(element, level=0, max_level=3):
+    def analyze_element(element_path, level=0):
         indent = "  " * level
         
         if level > max_level:
             return
         
-        # Mostrar información del elemento
-        print(f"{indent}<{element.tag}>")
-        
-        # Mostrar atributos si los tiene
-        if element.attrib:
-            print(f"{indent}  Atributos: {element.attrib}")
-        
-        # Contar hijos únicos
-        child_tags = {}
-        for child in element:
-            tag = child.tag
-            if tag not in child_tags:
-                child_tags[tag] = 0
-            child_tags[tag] += 1
-        
-        # Mostrar resumen de hijos
-        for tag, count in child_tags.items():
+        # Mostrar resumen de hijos (totales en todo el documento)
+        for (parent_path, tag), count in structure.items():
+            if parent_path != element_path:
+                continue
+            
             print(f"{indent}  └── <{tag}> ({count} elementos)")
             
-            # Analizar primer hijo de cada tipo
-            if level < max_level:
-                first_child = element.find(tag)
-                if first_child is not None:
-                    analyze_element(first_child, level + 1, max_level)
+            if structure_attrs[(parent_path, tag)]:
+                print(f"{indent}      Atributos: {structure_attrs[(parent_path, tag)]}")
             
-            if count > 1:
-                print(f"{indent}      ... y {count-1} más")
+            if level < max_level:
+                analyze_element(element_path + (tag,), level + 1)
     
-    analyze_element(root)
+    print(f"<{root_info[0]}>")
+    analyze_element((root_info[0],))
     
     # Buscar patrones comunes
     print("\n🔍 Buscando patrones comunes...")
     
-    patterns_to_check = [
-        'distinctParty',
-        'sdnEntry', 
-        'entry',
-        'record',
-        'entity',
-        'individual',
-        'person',
-        'organization',
-        'name',
-        'firstName',
-        'lastName'
-    ]
-    
     for pattern in patterns_to_check:
-        elements = root.findall(f'.//{pattern}')
-        if elements:
-            print(f"✅ Encontrados {len(elements)} elementos <{pattern}>")
+        if tag_counts[pattern]:
+            print(f"✅ Encontrados {tag_counts[pattern]} elementos <{pattern}>")
             
             # Mostrar estructura del primer elemento
-            if elements:
-                first_elem = elements[0]
-                print(f"   Primer elemento <{pattern}>:")
-                print(f"     Atributos: {first_elem.attrib}")
-                
-                # Mostrar hijos del primer elemento
-                children = list(first_elem)
-                if children:
-                    print(f"     Hijos: {[child.tag for child in children[:5]]}")
-                    if len(children) > 5:
-                        print(f"     ... y {len(children)-5} más")
-                
-                # Mostrar texto si lo tiene
-                if first_elem.text and first_elem.text.strip():
-                    print(f"     Texto: {first_elem.text.strip()[:50]}...")
+            first_elem = first_examples[pattern]
+            print(f"   Primer elemento <{pattern}>:")
+            print(f"     Atributos: {first_elem['attrib']}")
+            
+            # Mostrar hijos del primer elemento
+            children = first_elem['children']
+            if children:
+                print(f"     Hijos: {children[:5]}")
+                if len(children) > 5:
+                    print(f"     ... y {len(children)-5} más")
+            
+            # Mostrar texto si lo tiene
+            if first_elem['text']:
+                print(f"     Texto: {first_elem['text'][:50]}...")
         else:
             print(f"❌ No encontrados elementos <{pattern}>")
     
     # Buscar elementos con nombres
     print("\n🔍 Buscando elementos con nombres...")
     
-    # Buscar cualquier elemento que contenga texto parecido a nombres
-    all_elements = root.findall('.//*')
-    name_elements = []
-    
-    for elem in all_elements:
-        if elem.text and elem.text.strip():
-            text = elem.text.strip()
-            # Criterio simple: texto con espacios, mayúsculas, longitud razonable
-            if (' ' in text and 
-                any(c.isupper() for c in text) and 
-                3 < len(text) < 100 and
-                not text.isdigit()):
-                name_elements.append((elem.tag, text))
+    name_elements = [
+        (tag, text) for tag, text in zip(text_tags, texts)
+        if NAME_PATTERN.fullmatch(text)
+    ]
+    name_tag_counts = Counter(tag for tag, _ in name_elements)
     
     if name_elements:
         print(f"✅ Encontrados {len(name_elements)} elementos con posibles nombres")
@@ -129,12 +205,8 @@ def analyze_ofac_structure():
             print(f"     <{tag}>: {text}")
         
         # Mostrar estadísticas de tags
-        tag_counts = {}
-        for tag, _ in name_elements:
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
-        
         print("   Tags más comunes:")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:5]:
+        for tag, count in name_tag_counts.most_common(5):
             print(f"     <{tag}>: {count} elementos")
     else:
         print("❌ No se encontraron elementos con nombres aparentes")
@@ -142,4 +214,4 @@ def analyze_ofac_structure():
     print("\n✅ Análisis completado")
 
 if __name__ == "__main__":
-    analyze_ofac_structure()
\ No newline at end of file
+    analyze_ofac_structure()
@@ -5,20 +5,19 @@ Uso: python etl_cli.py [comando] [opciones]
 """
 
 import argparse
+import functools
 import sys
 import asyncio
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 
 # Agregar el directorio raíz al path
 sys.path.append(str(Path(__file__).parent))
 
-from app.etl.ofac_parser_final import OFACParserFinal, run_ofac_update
-from app.etl.un_parser_final import  UNParserFinal, run_un_update
-from app.etl.scheduler import ETLScheduler
-from app.models.database import SessionLocal
-from app.models.entities import Entity, UpdateLog
-from sqlalchemy import func, desc
+# Los parsers, el scheduler y SQLAlchemy se importan dentro de cada comando:
+# `--help` o `logs` no deben pagar la carga de lxml/apscheduler
 
 def print_banner():
     """Mostrar banner de la aplicación"""
@@ -42,6 +41,23 @@ def print_stats(stats):
         for error in stats['errors'][:5]:  # Mostrar solo los primeros 5
             print(f"      - {error}")
 
+def print_update_result(label, result, duration):
+    """Mostrar el resultado de la actualización de una fuente"""
+    if result.get('status') == 'success':
+        print(f"✅ Actualización {label} completada exitosamente")
+        print(f"   Duración: {duration:.2f} segundos")
+        print()
+        print_stats(result.get('stats', {}))
+        
+    elif result.get('status') == 'no_changes':
+        print(f"ℹ️  No hay cambios en los datos de {label}")
+        print(f"   Hash del archivo: {result.get('hash', 'N/A')}")
+        
+    else:
+        print(f"❌ Error en actualización de {label}")
+        print(f"   Error: {result.get('error', 'Error desconocido')}")
+        print(f"   Duración: {duration:.2f} segundos")
+
 def update_ofac(args):
     """Actualizar datos de OFAC"""
     print("🔄 Iniciando actualización de OFAC...")
@@ -52,24 +68,11 @@ def update_ofac(args):
     start_time = datetime.now()
     
     try:
+        from app.etl.ofac_parser_final import run_ofac_update
         result = run_ofac_update()
         
         duration = (datetime.now() - start_time).total_seconds()
-        
-        if result.get('status') == 'success':
-            print("✅ Actualización OFAC completada exitosamente")
-            print(f"   Duración: {duration:.2f} segundos")
-            print()
-            print_stats(result.get('stats', {}))
-            
-        elif result.get('status') == 'no_changes':
-            print("ℹ️  No hay cambios en los datos de OFAC")
-            print(f"   Hash del archivo: {result.get('hash', 'N/A')}")
-            
-        else:
-            print("❌ Error en actualización de OFAC")
-            print(f"   Error: {result.get('error', 'Error desconocido')}")
-            print(f"   Duración: {duration:.2f} segundos")
+        print_update_result("OFAC", result, duration)
             
     except Exception as e:
         print(f"❌ Error crítico: {e}")
@@ -85,24 +88,11 @@ def update_un(args):
     start_time = datetime.now()
     
     try:
+        from app.etl.un_parser_final import run_un_update
         result = run_un_update()
         
         duration = (datetime.now() - start_time).total_seconds()
-        
-        if result.get('status') == 'success':
-            print("✅ Actualización ONU completada exitosamente")
-            print(f"   Duración: {duration:.2f} segundos")
-            print()
-            print_stats(result.get('stats', {}))
-            
-        elif result.get('status') == 'no_changes':
-            print("ℹ️  No hay cambios en los datos de ONU")
-            print(f"   Hash del archivo: {result.get('hash', 'N/A')}")
-            
-        else:
-            print("❌ Error en actualización de ONU")
-            print(f"   Error: {result.get('error', 'Error desconocido')}")
-            print(f"   Duración: {duration:.2f} segundos")
+        print_update_result("ONU", result, duration)
             
     except Exception as e:
         print(f"❌ Error crítico: {e}")
@@ -110,89 +100,136 @@ def update_un(args):
     
     return 0
 
+async def run_timed_update(pool, update_func):
+    """Ejecutar una actualización en un proceso del pool y medir su duración"""
+    start_time = datetime.now()
+    result = await asyncio.get_running_loop().run_in_executor(pool, update_func)
+    return result, (datetime.now() - start_time).total_seconds()
+
+async def run_all_updates():
+    """Descargar y procesar OFAC y ONU en paralelo (un proceso por fuente: el parseo XML no comparte GIL)"""
+    from app.etl.ofac_parser_final import run_ofac_update
+    from app.etl.un_parser_final import run_un_update
+    from app.models.database import dispose_inherited_pool
+    
+    with ProcessPoolExecutor(max_workers=2, initializer=dispose_inherited_pool) as pool:
+        return await asyncio.gather(
+            run_timed_update(pool, run_ofac_update),
+            run_timed_update(pool, run_un_update),
+            return_exceptions=True
+        )
+
 def update_all(args):
     """Actualizar ambas fuentes"""
-    print("🔄 Iniciando actualización completa (OFAC + ONU)...")
+    print("🔄 Iniciando actualización completa (OFAC + ONU en paralelo)...")
     print()
     
-    # Crear un objeto args mock para las funciones individuales
-    class MockArgs:
-        def __init__(self):
-            self.source = None
-            self.limit = 10
-            self.status = None
+    outcomes = asyncio.run(run_all_updates())
+    
+    # Mostrar resultados en orden una vez terminadas ambas
+    exit_code = 0
+    for index, (label, outcome) in enumerate(zip(["OFAC", "ONU"], outcomes), start=1):
+        print(f"{index}️⃣ {label}:")
+        
+        if isinstance(outcome, Exception):
+            print(f"❌ Error crítico: {outcome}")
+            exit_code = 1
+        else:
+            result, duration = outcome
+            print_update_result(label, result, duration)
+        print()
+    
+    if exit_code == 0:
+        print("✅ Actualización completa exitosa")
+    else:
+        print("❌ Hubo errores en la actualización")
+    return exit_code
+
+async def with_async_db(func, *args):
+    """Ejecutar una corrutina con una AsyncSession y liberar el pool al terminar"""
+    from app.models.database import AsyncSessionLocal, async_engine
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            return await func(db, *args)
+    finally:
+        await async_engine.dispose()
+
+def write_json_line(record):
+    """Emitir un registro NDJSON (orjson serializa las fechas en ISO 8601)"""
+    sys.stdout.buffer.write(orjson.dumps(record) + b"\n")
+
+def update_log_record(log):
+    return {
+        'source': log.source,
+        'update_date': log.update_date,
+        'status': log.status,
+        'records_added': log.records_added,
+        'records_updated': log.records_updated,
+        'records_deleted': log.records_deleted,
+        'error_message': log.error_message,
+    }
+
+async def print_db_stats(db, args):
+    """Consultar y mostrar las estadísticas (E/S de BD no bloqueante)"""
+    from app.models.entities import Entity, UpdateLog
+    from sqlalchemy import select, func, desc
+    
+    # Una consulta agrupada por dimensión en lugar de un COUNT por valor
+    by_source = dict((await db.execute(select(Entity.source, func.count()).group_by(Entity.source))).all())
+    by_type = dict((await db.execute(select(Entity.type, func.count()).group_by(Entity.type))).all())
+    by_status = dict((await db.execute(select(Entity.status, func.count()).group_by(Entity.status))).all())
     
-    mock_args = MockArgs()
+    total_entities = sum(by_source.values())
     
-    # Actualizar OFAC
-    print("1️⃣ Actualizando OFAC...")
-    ofac_result = update_ofac(mock_args)
+    recent_updates = (await db.scalars(
+        select(UpdateLog).order_by(desc(UpdateLog.update_date)).limit(5)
+    )).all()
+    
+    if args.json:
+        write_json_line({
+            'total_entities': total_entities,
+            'by_source': by_source,
+            'by_type': by_type,
+            'by_status': by_status,
+            'recent_updates': [update_log_record(update) for update in recent_updates],
+        })
+        return
+    
+    print(f"📈 Totales:")
+    print(f"   • Total de entidades: {total_entities:,}")
+    print(f"   • OFAC: {by_source.get('OFAC', 0):,}")
+    print(f"   • ONU: {by_source.get('UN', 0):,}")
     print()
     
-    # Actualizar ONU
-    print("2️⃣ Actualizando ONU...")
-    un_result = update_un(mock_args)
+    print(f"👥 Por tipo:")
+    print(f"   • Individuos: {by_type.get('INDIVIDUAL', 0):,}")
+    print(f"   • Entidades: {by_type.get('ENTITY', 0):,}")
+    print(f"   • Embarcaciones: {by_type.get('VESSEL', 0):,}")
+    print(f"   • Aeronaves: {by_type.get('AIRCRAFT', 0):,}")
     print()
     
-    if ofac_result == 0 and un_result == 0:
-        print("✅ Actualización completa exitosa")
-        return 0
-    else:
-        print("❌ Hubo errores en la actualización")
-        return 1
+    print(f"🎯 Por estado:")
+    print(f"   • Activos: {by_status.get('ACTIVE', 0):,}")
+    print(f"   • Actualizados: {by_status.get('UPDATED', 0):,}")
+    print()
+    
+    # Últimas actualizaciones
+    print(f"🕐 Últimas actualizaciones:")
+    for update in recent_updates:
+        status_icon = "✅" if update.status == 'SUCCESS' else "❌"
+        print(f"   {status_icon} {update.source} - {update.update_date.strftime('%Y-%m-%d %H:%M:%S')}")
+        if update.status == 'SUCCESS':
+            print(f"      Agregadas: {update.records_added}, Actualizadas: {update.records_updated}")
 
 def show_stats(args):
     """Mostrar estadísticas de la base de datos"""
-    print("📊 Estadísticas de la base de datos:")
-    print()
+    if not args.json:
+        print("📊 Estadísticas de la base de datos:")
+        print()
     
     try:
-        db = SessionLocal()
-        
-        # Estadísticas generales
-        total_entities = db.query(Entity).count()
-        ofac_count = db.query(Entity).filter(Entity.source == 'OFAC').count()
-        un_count = db.query(Entity).filter(Entity.source == 'UN').count()
-        
-        # Por tipo
-        individual_count = db.query(Entity).filter(Entity.type == 'INDIVIDUAL').count()
-        entity_count = db.query(Entity).filter(Entity.type == 'ENTITY').count()
-        vessel_count = db.query(Entity).filter(Entity.type == 'VESSEL').count()
-        aircraft_count = db.query(Entity).filter(Entity.type == 'AIRCRAFT').count()
-        
-        # Por estado
-        active_count = db.query(Entity).filter(Entity.status == 'ACTIVE').count()
-        updated_count = db.query(Entity).filter(Entity.status == 'UPDATED').count()
-        
-        print(f"📈 Totales:")
-        print(f"   • Total de entidades: {total_entities:,}")
-        print(f"   • OFAC: {ofac_count:,}")
-        print(f"   • ONU: {un_count:,}")
-        print()
-        
-        print(f"👥 Por tipo:")
-        print(f"   • Individuos: {individual_count:,}")
-        print(f"   • Entidades: {entity_count:,}")
-        print(f"   • Embarcaciones: {vessel_count:,}")
-        print(f"   • Aeronaves: {aircraft_count:,}")
-        print()
-        
-        print(f"🎯 Por estado:")
-        print(f"   • Activos: {active_count:,}")
-        print(f"   • Actualizados: {updated_count:,}")
-        print()
-        
-        # Últimas actualizaciones
-        print(f"🕐 Últimas actualizaciones:")
-        recent_updates = db.query(UpdateLog).order_by(desc(UpdateLog.update_date)).limit(5).all()
-        
-        for update in recent_updates:
-            status_icon = "✅" if update.status == 'SUCCESS' else "❌"
-            print(f"   {status_icon} {update.source} - {update.update_date.strftime('%Y-%m-%d %H:%M:%S')}")
-            if update.status == 'SUCCESS':
-                print(f"      Agregadas: {update.records_added}, Actualizadas: {update.records_updated}")
-        
-        db.close()
+        asyncio.run(with_async_db(print_db_stats, args))
         
     except Exception as e:
         print(f"❌ Error obteniendo estadísticas: {e}")
@@ -200,38 +237,47 @@ def show_stats(args):
     
     return 0
 
-def show_logs(args):
-    """Mostrar logs de actualización"""
-    print(f"📄 Logs de actualización (últimas {args.limit}):")
-    print()
+async def print_update_logs(db, args):
+    """Consultar y mostrar los logs de actualización (E/S de BD no bloqueante)"""
+    from app.models.entities import UpdateLog
+    from sqlalchemy import select, desc
     
-    try:
-        db = SessionLocal()
-        
-        query = db.query(UpdateLog).order_by(desc(UpdateLog.update_date))
-        
-        if args.source:
-            query = query.filter(UpdateLog.source == args.source.upper())
+    query = select(UpdateLog).order_by(desc(UpdateLog.update_date))
+    
+    if args.source:
+        query = query.where(UpdateLog.source == args.source.upper())
+    
+    if args.status:
+        query = query.where(UpdateLog.status == args.status.upper())
+    
+    # Cursor de servidor: se imprime por lotes sin materializar todo el resultado
+    logs = await db.stream_scalars(query.limit(args.limit).execution_options(yield_per=100))
+    
+    async for log in logs:
+        if args.json:
+            write_json_line(update_log_record(log))
+            continue
         
-        if args.status:
-            query = query.filter(UpdateLog.status == args.status.upper())
+        status_icon = "✅" if log.status == 'SUCCESS' else "❌" if log.status == 'FAILED' else "⏳"
+        print(f"{status_icon} {log.source} - {log.update_date.strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"   Estado: {log.status}")
         
-        logs = query.limit(args.limit).all()
+        if log.status == 'SUCCESS':
+            print(f"   Agregadas: {log.records_added}, Actualizadas: {log.records_updated}")
         
-        for log in logs:
-            status_icon = "✅" if log.status == 'SUCCESS' else "❌" if log.status == 'FAILED' else "⏳"
-            print(f"{status_icon} {log.source} - {log.update_date.strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"   Estado: {log.status}")
-            
-            if log.status == 'SUCCESS':
-                print(f"   Agregadas: {log.records_added}, Actualizadas: {log.records_updated}")
-            
-            if log.error_message:
-                print(f"   Error: {log.error_message[:100]}...")
-            
-            print()
+        if log.error_message:
+            print(f"   Error: {log.error_message[:100]}...")
         
-        db.close()
+        print()
+
+def show_logs(args):
+    """Mostrar logs de actualización"""
+    if not args.json:
+        print(f"📄 Logs de actualización (últimas {args.limit}):")
+        print()
+    
+    try:
+        asyncio.run(with_async_db(print_update_logs, args))
         
     except Exception as e:
         print(f"❌ Error obteniendo logs: {e}")
@@ -245,23 +291,9 @@ def run_scheduler(args):
     print()
     
     try:
+        from app.etl.scheduler import ETLScheduler
         scheduler = ETLScheduler()
         
-        # Configurar señales para terminación limpia
-        import signal
-        
-        def signal_handler(sig, frame):
-            print("\n🛑 Deteniendo scheduler...")
-            scheduler.stop()
-            sys.exit(0)
-        
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
-        
-        # Iniciar scheduler
-        scheduler.start()
-        
-        print("✅ Scheduler iniciado exitosamente")
         print("📅 Programación:")
         print("   • OFAC: Diario a las 8:00 AM UTC")
         print("   • ONU: Lunes a las 9:00 AM UTC")
@@ -269,8 +301,10 @@ def run_scheduler(args):
         print()
         print("Presiona Ctrl+C para detener...")
         
-        # Mantener el programa corriendo
-        asyncio.get_event_loop().run_forever()
+        # Corre en un único event loop hasta SIGINT/SIGTERM; la parada es ordenada
+        asyncio.run(scheduler.run_until_stopped())
+        print("\n🛑 Scheduler detenido")
+        return 0
         
     except KeyboardInterrupt:
         print("\n🛑 Scheduler detenido por el usuario")
@@ -279,10 +313,9 @@ def run_scheduler(args):
         print(f"❌ Error en scheduler: {e}")
         return 1
 
-def main():
-    """Función principal"""
-    print_banner()
-    
+@functools.lru_cache(maxsize=1)
+def build_parser():
+    """Construir el árbol de argparse una sola vez por proceso"""
     parser = argparse.ArgumentParser(
         description="CLI para administrar el ETL de Sanctions API",
         formatter_class=argparse.RawDescriptionHelpFormatter
@@ -303,17 +336,28 @@ def main():
     
     # Comando stats
     stats_parser = subparsers.add_parser('stats', help='Mostrar estadísticas')
+    stats_parser.add_argument('--json', action='store_true', help='Salida JSON (NDJSON)')
     
     # Comando logs
     logs_parser = subparsers.add_parser('logs', help='Mostrar logs')
     logs_parser.add_argument('--limit', type=int, default=10, help='Número de logs a mostrar')
     logs_parser.add_argument('--source', choices=['ofac', 'un'], help='Filtrar por fuente')
     logs_parser.add_argument('--status', choices=['success', 'failed'], help='Filtrar por estado')
+    logs_parser.add_argument('--json', action='store_true', help='Salida NDJSON (un log por línea)')
     
     # Comando scheduler
     scheduler_parser = subparsers.add_parser('scheduler', help='Ejecutar scheduler')
     
-    args = parser.parse_args()
+    return parser
+
+def main(argv=None):
+    """Función principal (argv permite invocarla varias veces en el mismo proceso)"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    # El banner ensuciaría la salida NDJSON
+    if not getattr(args, 'json', False):
+        print_banner()
     
     if not args.command:
         parser.print_help()
@@ -1,4 +1,4 @@
-# run_scheduler_simple.py - Scheduler simplificado sin async
+# run_scheduler_simple.py - Scheduler simplificado sobre asyncio
 """
 Scheduler simplificado para ETL sin problemas de async
 Uso: python run_scheduler_simple.py
@@ -6,11 +6,18 @@ Uso: python run_scheduler_simple.py
 
 import sys
 import signal
+import asyncio
 import time
+import queue
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
-from apscheduler.schedulers.blocking import BlockingScheduler
+from concurrent.futures import ProcessPoolExecutor
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -19,27 +26,52 @@ sys.path.append(str(Path(__file__).parent))
 
 from app.etl.ofac_parser_final import run_ofac_update
 from app.etl.un_parser_final import run_un_update
-from app.models.database import SessionLocal
+from app.models.database import AsyncSessionLocal, dispose_inherited_pool
+from app.models.partitions import ensure_usage_partitions, detach_old_usage_partitions
 from app.models.entities import UpdateLog
-from sqlalchemy import text
+from sqlalchemy import select, func
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/scheduler.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configurar logging: los jobs solo encolan; un hilo escribe en disco y consola
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler('logs/scheduler.log'), logging.StreamHandler()]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))  # el formato final lo aplica el listener
+
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# force: los parsers ya llamaron a basicConfig al importarse
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
 logger = logging.getLogger(__name__)
 
+def _init_etl_worker():
+    """Inicializar un proceso del pool ETL (no hereda el hilo del QueueListener)"""
+    dispose_inherited_pool()
+    
+    # Sin listener la cola no se vaciaría: el hijo escribe directamente
+    root = logging.getLogger()
+    root.removeHandler(queue_handler)
+    for handler in log_handlers:
+        root.addHandler(handler)
+
+# Ejecuciones recientes que se conservan en memoria
+UPDATE_HISTORY_SIZE = 100
+
 class SimpleETLScheduler:
     """Scheduler simplificado para ETL"""
     
     def __init__(self):
-        self.scheduler = BlockingScheduler()
-        self.update_history = []
+        # Los jobs corren en el event loop; el parseo XML (CPU) va a procesos aparte
+        self.scheduler = AsyncIOScheduler(executors={'default': AsyncIOExecutor()})
+        self.process_pool = ProcessPoolExecutor(max_workers=2, initializer=_init_etl_worker)
+        self.loop = None
+        # Solo las últimas ejecuciones (el histórico completo está en update_logs)
+        self.update_history = deque(maxlen=UPDATE_HISTORY_SIZE)
         
     def send_notification(self, subject: str, body: str, is_error: bool = False):
         """Enviar notificación simple por log"""
@@ -47,20 +79,20 @@ class SimpleETLScheduler:
         logger.log(level, f"NOTIFICACIÓN: {subject}")
         logger.log(level, body)
     
-    def run_ofac_update_job(self):
-        """Job para actualizar datos de OFAC"""
-        logger.info("🔄 Iniciando actualización programada de OFAC")
+    async def _run_source_job(self, source: str, label: str, update_func):
+        """Ejecutar la actualización de una fuente en el pool de procesos y notificar el resultado"""
+        logger.info(f"🔄 Iniciando actualización programada de {label}")
         
         try:
             start_time = datetime.utcnow()
-            result = run_ofac_update()
+            result = await self.loop.run_in_executor(self.process_pool, update_func)
             duration = (datetime.utcnow() - start_time).total_seconds()
             
             # Registrar resultado
             self.update_history.append({
-                'source': 'OFAC',
+                'source': source,
                 'timestamp': datetime.utcnow(),
-                'result': result,
+                'status': result.get('status'),
                 'success': result.get('status') == 'success',
                 'duration': duration
             })
@@ -69,7 +101,7 @@ class SimpleETLScheduler:
             if result.get('status') == 'success':
                 stats = result.get('stats', {})
                 message = f"""
-✅ Actualización OFAC exitosa
+✅ Actualización {label} exitosa
 - Entidades agregadas: {stats.get('entities_added', 0)}
 - Entidades actualizadas: {stats.get('entities_updated', 0)}
 - Aliases agregados: {stats.get('aliases_added', 0)}
@@ -77,96 +109,53 @@ class SimpleETLScheduler:
 - Documentos agregados: {stats.get('documents_added', 0)}
 - Duración: {duration:.2f} segundos
 """
-                self.send_notification("Actualización OFAC exitosa", message)
+                self.send_notification(f"Actualización {label} exitosa", message)
                 
             elif result.get('status') == 'no_changes':
-                logger.info("ℹ️ No hay cambios en datos de OFAC")
+                logger.info(f"ℹ️ No hay cambios en datos de {label}")
                 
             else:
                 error_msg = f"""
-❌ Error en actualización OFAC
+❌ Error en actualización {label}
 - Error: {result.get('error', 'Error desconocido')}
 - Duración: {duration:.2f} segundos
 """
-                self.send_notification("Error en actualización OFAC", error_msg, is_error=True)
+                self.send_notification(f"Error en actualización {label}", error_msg, is_error=True)
             
-            logger.info(f"Actualización OFAC completada: {result.get('status')}")
+            logger.info(f"Actualización {label} completada: {result.get('status')}")
             
         except Exception as e:
-            logger.error(f"Error crítico en job de OFAC: {e}")
+            logger.error(f"Error crítico en job de {label}: {e}")
             self.send_notification(
-                "Error crítico en actualización OFAC",
+                f"Error crítico en actualización {label}",
                 f"Error crítico: {str(e)}",
                 is_error=True
             )
     
-    def run_un_update_job(self):
+    async def run_ofac_update_job(self):
+        """Job para actualizar datos de OFAC"""
+        await self._run_source_job('OFAC', 'OFAC', run_ofac_update)
+    
+    async def run_un_update_job(self):
         """Job para actualizar datos de ONU"""
-        logger.info("🔄 Iniciando actualización programada de ONU")
-        
-        try:
-            start_time = datetime.utcnow()
-            result = run_un_update()
-            duration = (datetime.utcnow() - start_time).total_seconds()
-            
-            # Registrar resultado
-            self.update_history.append({
-                'source': 'UN',
-                'timestamp': datetime.utcnow(),
-                'result': result,
-                'success': result.get('status') == 'success',
-                'duration': duration
-            })
-            
-            # Notificar según resultado
-            if result.get('status') == 'success':
-                stats = result.get('stats', {})
-                message = f"""
-✅ Actualización ONU exitosa
-- Entidades agregadas: {stats.get('entities_added', 0)}
-- Entidades actualizadas: {stats.get('entities_updated', 0)}
-- Aliases agregados: {stats.get('aliases_added', 0)}
-- Direcciones agregadas: {stats.get('addresses_added', 0)}
-- Documentos agregados: {stats.get('documents_added', 0)}
-- Duración: {duration:.2f} segundos
-"""
-                self.send_notification("Actualización ONU exitosa", message)
-                
-            elif result.get('status') == 'no_changes':
-                logger.info("ℹ️ No hay cambios en datos de ONU")
-                
-            else:
-                error_msg = f"""
-❌ Error en actualización ONU
-- Error: {result.get('error', 'Error desconocido')}
-- Duración: {duration:.2f} segundos
-"""
-                self.send_notification("Error en actualización ONU", error_msg, is_error=True)
-            
-            logger.info(f"Actualización ONU completada: {result.get('status')}")
-            
-        except Exception as e:
-            logger.error(f"Error crítico en job de ONU: {e}")
-            self.send_notification(
-                "Error crítico en actualización ONU",
-                f"Error crítico: {str(e)}",
-                is_error=True
+        await self._run_source_job('UN', 'ONU', run_un_update)
+    
+    async def health_check(self):
+        """Verificar la BD con una AsyncSession (no bloquea el event loop)"""
+        async with AsyncSessionLocal() as db:
+            # Una sola ida y vuelta: si el COUNT responde, la conexión funciona
+            return await db.scalar(
+                select(func.count()).select_from(UpdateLog).where(
+                    UpdateLog.update_date >= datetime.utcnow() - timedelta(days=7)
+                )
             )
     
-    def health_check_job(self):
+    async def health_check_job(self):
         """Job para verificar salud del sistema"""
         logger.info("🏥 Ejecutando health check")
         
         try:
-            db = SessionLocal()
-            
-            # Verificar conexión a BD
-            db.execute(text("SELECT 1"))
-            
-            # Verificar actualizaciones recientes
-            recent_updates = db.query(UpdateLog).filter(
-                UpdateLog.update_date >= datetime.utcnow() - timedelta(days=7)
-            ).count()
+            recent_updates = await self.health_check()
             
             if recent_updates == 0:
                 logger.warning("⚠️ No hay actualizaciones en los últimos 7 días")
@@ -178,8 +167,6 @@ class SimpleETLScheduler:
             else:
                 logger.info(f"✅ Health check OK. Actualizaciones recientes: {recent_updates}")
             
-            db.close()
-            
         except Exception as e:
             logger.error(f"❌ Error en health check: {e}")
             self.send_notification(
@@ -188,6 +175,23 @@ class SimpleETLScheduler:
                 is_error=True
             )
     
+    def usage_partitions_job(self):
+        """Job para crear la partición del próximo mes y separar las antiguas (corre en un hilo)"""
+        logger.info("🗂️ Mantenimiento de particiones de api_usage")
+        
+        try:
+            created = ensure_usage_partitions()
+            detached = detach_old_usage_partitions()
+            logger.info(f"✅ Particiones creadas: {len(created)}, separadas: {len(detached)}")
+            
+        except Exception as e:
+            logger.error(f"❌ Error manteniendo particiones: {e}")
+            self.send_notification(
+                "Error en particiones de api_usage",
+                f"Error manteniendo particiones: {str(e)}",
+                is_error=True
+            )
+    
     def setup_jobs(self):
         """Configurar jobs programados"""
         try:
@@ -218,6 +222,15 @@ class SimpleETLScheduler:
                 replace_existing=True
             )
             
+            # Particiones de api_usage - Día 1 de cada mes a las 00:30 UTC
+            self.scheduler.add_job(
+                self.usage_partitions_job,
+                trigger=CronTrigger(day=1, hour=0, minute=30),
+                id='usage_partitions',
+                name='Particiones de uso',
+                replace_existing=True
+            )
+            
             logger.info("✅ Jobs programados configurados exitosamente")
             
         except Exception as e:
@@ -228,6 +241,8 @@ class SimpleETLScheduler:
         """Iniciar scheduler"""
         try:
             logger.info("🚀 Configurando scheduler...")
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
             self.setup_jobs()
             
             # Mostrar jobs configurados
@@ -241,9 +256,11 @@ class SimpleETLScheduler:
             
             # Ejecutar health check inicial
             logger.info("🏥 Ejecutando health check inicial...")
-            self.health_check_job()
+            self.loop.run_until_complete(self.health_check_job())
             
+            # AsyncIOScheduler no bloquea: el event loop mantiene vivo el proceso
             self.scheduler.start()
+            self.loop.run_forever()
             
         except Exception as e:
             logger.error(f"❌ Error iniciando scheduler: {e}")
@@ -253,7 +270,10 @@ class SimpleETLScheduler:
         """Detener scheduler"""
         try:
             logger.info("🛑 Deteniendo scheduler...")
-            self.scheduler.shutdown()
+            self.scheduler.shutdown(wait=False)
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            if self.loop is not None:
+                self.loop.stop()
             logger.info("✅ Scheduler detenido")
         except Exception as e:
             logger.error(f"❌ Error deteniendo scheduler: {e}")
@@ -285,6 +305,7 @@ def main():
         print("   • OFAC: Diario a las 8:00 AM UTC")
         print("   • ONU: Lunes a las 9:00 AM UTC")  
         print("   • Health Check: Cada 6 horas")
+        print("   • Particiones de uso: Día 1 de cada mes")
         print()
         print("🔧 Para detener el scheduler, presiona Ctrl+C")
         print("📊 Logs disponibles en: logs/scheduler.log")
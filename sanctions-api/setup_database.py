@@ -12,10 +12,12 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent))
 
 from app.models.database import create_tables, reset_database, engine
+from app.models.bulk import bulk_insert
 from app.models.entities import *
 from app.core.config import settings
+from app.core.hashing import content_hash
+from sqlalchemy import func, insert
 from sqlalchemy.orm import sessionmaker
-import hashlib
 import uuid
 
 def create_sample_client():
@@ -66,51 +68,50 @@ def insert_sample_data():
     
     try:
         # Verificar si ya hay datos
-        existing_count = session.query(Entity).count()
+        existing_count = session.query(func.count(Entity.id)).scalar()
         if existing_count > 0:
             print(f"✅ Ya existen {existing_count} entidades en la base de datos")
             return
         
-        # Crear entidad de ejemplo
-        sample_entity = Entity(
-            source="OFAC",
-            source_id="12345",
-            name="EJEMPLO SANCIONADO",
-            type="INDIVIDUAL",
-            gender="Male",
-            status="ACTIVE",
-            hash_signature=hashlib.md5("test_data".encode()).hexdigest()
-        )
-        
-        session.add(sample_entity)
-        session.flush()  # Para obtener el ID
-        
-        # Agregar alias
-        sample_alias = Alias(
-            entity_id=sample_entity.id,
-            alias_name="ALIAS DE EJEMPLO",
-            quality="STRONG"
-        )
-        session.add(sample_alias)
-        
-        # Agregar dirección
-        sample_address = Address(
-            entity_id=sample_entity.id,
-            full_address="123 Main St, Example City",
-            city="Example City",
-            country="US",
-            postal_code="12345"
-        )
-        session.add(sample_address)
-        
-        # Agregar sanción
-        sample_sanction = Sanction(
-            entity_id=sample_entity.id,
-            program="IRAN",
-            authority="OFAC",
-            comments="Entidad de ejemplo para pruebas"
-        )
-        session.add(sample_sanction)
+        # Crear entidad de ejemplo (RETURNING devuelve el ID en el mismo INSERT)
+        entity_id = session.execute(
+            insert(Entity).values(
+                source="OFAC",
+                source_id="12345",
+                name="EJEMPLO SANCIONADO",
+                type="INDIVIDUAL",
+                gender="Male",
+                status="ACTIVE",
+                hash_signature=content_hash("test_data")
+            ).returning(Entity.id)
+        ).scalar_one()
+        
+        # Hijos agrupados por tabla: un INSERT multi-fila (o COPY si el lote es grande) por tabla
+        sample_children = {
+            Alias: [
+                {'entity_id': entity_id, 'alias_name': "ALIAS DE EJEMPLO", 'quality': "STRONG"},
+            ],
+            Address: [
+                {
+                    'entity_id': entity_id,
+                    'full_address': "123 Main St, Example City",
+                    'city': "Example City",
+                    'country': "US",
+                    'postal_code': "12345"
+                },
+            ],
+            Sanction: [
+                {
+                    'entity_id': entity_id,
+                    'program': "IRAN",
+                    'authority': "OFAC",
+                    'comments': "Entidad de ejemplo para pruebas"
+                },
+            ],
+        }
+        
+        for model, rows in sample_children.items():
+            bulk_insert(session, model.__table__, rows)
         
         session.commit()
         print("✅ Datos de ejemplo insertados")